@@ -0,0 +1,420 @@
+"""Charge synthétique : des milliers de guilds pilotées par les vraies commandes, sans Discord
+
+    python benchmarks/load_guilds.py --guilds 2000 --duration 60
+    python benchmarks/load_guilds.py --guilds 2000 --compare benchmarks/results/<ancien>.json
+
+Le bot (MusicBotManager, MusicBot, commandes, Resolver, caches, TrackChain, GainStage) tourne
+tel quel. Seuls les bords sont simulés :
+- yt-dlp : _extract_info renvoie des infos fabriquées après une latence réglable ;
+- FFmpeg : open_primed_source fabrique des sources PCM en mémoire (mêmes classes autour) ;
+- Discord : contexte, salon vocal et VoiceClient factices ; un seul thread "audio" lit une
+  trame de 20 ms par guild en lecture, au rythme réel, comme les AudioPlayer de discord.py.
+
+Sortie : débit de commandes, percentiles de latence par commande, délai jusqu'au premier son,
+mémoire par guild, retard de l'event loop et du thread audio. Le résultat est enregistré en
+JSON dans benchmarks/results/ pour comparer les versions entre elles (--compare).
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+RESULTS_DIR = os.path.join(HERE, "results")
+
+# environnement isolé, fixé avant l'import du bot (ses constantes sont lues à l'import)
+_tmp = tempfile.mkdtemp(prefix="botmusic-bench-")
+os.environ.update({
+    "METADATA_DB": os.path.join(_tmp, "meta.sqlite3"),
+    "MUSIC_DIRS": os.path.join(_tmp, "music"),
+    "TRACK_CACHE_MB": "0",
+    "OPUS_CACHE": "0",
+    "WATCHDOG_LOG": "",
+    "QUEUE_STORE": "",
+    "GUILD_IDLE_TIMEOUT": "0",
+    "METRICS_PORT": "0",
+})
+sys.path.insert(0, ROOT)
+import multibot  # noqa: E402
+
+FRAME = b"\x01\x00" * 1920  # 20 ms de PCM 48 kHz stéréo 16 bits
+
+# --- bords simulés ---
+
+class FakeExtractor:
+    """Remplace yt-dlp : pistes et playlists d'un catalogue fixe, latence réseau simulée"""
+    def __init__(self, latency: float, track_seconds: float, playlist_size: int):
+        self.latency = latency
+        self.track_seconds = track_seconds
+        self.playlist_size = playlist_size
+        self.calls = 0
+
+    def __call__(self, url: str, opts: dict):
+        self.calls += 1
+        time.sleep(random.uniform(0.5, 1.5) * self.latency)  # dans un thread du Resolver, comme yt-dlp
+        kind, _, ident = url.rstrip("/").rpartition("/")
+        if kind.endswith("/playlist"):
+            entries = [{"title": f"Piste {ident}-{i}", "url": f"https://bench.invalid/track/{ident}-{i}",
+                        "duration": self.track_seconds} for i in range(self.playlist_size)]
+            return {"_type": "playlist", "title": f"Playlist {ident}", "webpage_url": url, "entries": entries}
+        return {"title": f"Piste {ident}", "url": f"bench://stream/{ident}", "webpage_url": url,
+                "duration": self.track_seconds, "acodec": "opus", "ext": "webm", "abr": 128,
+                "formats": [{"format_id": "251", "acodec": "opus", "ext": "webm", "abr": 128,
+                             "url": f"bench://stream/{ident}"}]}
+
+class FakePCMSource(multibot.discord.AudioSource):
+    def __init__(self, frames: int):
+        self.remaining = frames
+
+    def read(self) -> bytes:
+        if self.remaining <= 0:
+            return b""
+        self.remaining -= 1
+        return FRAME
+
+def make_source_opener(track_seconds: float, spawn_cost: float):
+    frames = int(track_seconds / multibot.FRAME_SECONDS)
+
+    def open_fake_source(stream_url, acodec=None, owner=None, start=0.0, item=None, slot=None):
+        time.sleep(spawn_cost)  # lancement de FFmpeg + premières trames
+        left = max(1, frames - int(start / multibot.FRAME_SECONDS))
+        primed = multibot.PrimedSource(FakePCMSource(left)).prime(multibot.PRIME_FRAMES)
+        return multibot.GainStage(primed, owner) if owner is not None else primed
+    return open_fake_source
+
+class AudioClock:
+    """Un thread pour toutes les guilds : une trame par VoiceClient en lecture toutes les 20 ms"""
+    def __init__(self):
+        self.clients = set()
+        self.lock = threading.Lock()
+        self.overruns = []  # retard de chaque tick sur son échéance
+        self.frames = 0
+        self.running = True
+        threading.Thread(target=self.run, name="bench-audio", daemon=True).start()
+
+    def run(self):
+        deadline = time.perf_counter()
+        while self.running:
+            deadline += multibot.FRAME_SECONDS
+            with self.lock:
+                clients = list(self.clients)
+            for vc in clients:
+                vc.tick()
+            now = time.perf_counter()
+            self.overruns.append(max(0.0, now - deadline))
+            if now < deadline:
+                time.sleep(deadline - now)
+            else:
+                deadline = now  # en retard : on ne rattrape pas, comme l'AudioPlayer
+
+class FakeVoiceClient:
+    def __init__(self, clock: AudioClock, channel, stats: "Stats"):
+        self.clock = clock
+        self.channel = channel
+        self.stats = stats
+        self.source = None
+        self.after = None
+        self.paused = False
+        self.stopping = False
+        self.connected = True
+
+    # API utilisée par MusicBot
+    def play(self, source, *, after=None):
+        self.source, self.after, self.paused, self.stopping = source, after, False, False
+        with self.clock.lock:
+            self.clock.clients.add(self)
+
+    def is_playing(self):
+        return self.source is not None and not self.paused
+
+    def is_paused(self):
+        return self.source is not None and self.paused
+
+    def is_connected(self):
+        return self.connected
+
+    def pause(self):
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+
+    def stop(self):
+        self.stopping = True
+
+    async def move_to(self, channel):
+        self.channel = channel
+
+    async def disconnect(self, *, force=False):
+        self.stop()
+        self.connected = False
+
+    def tick(self):
+        """Appelé par l'horloge audio (son thread), comme AudioPlayer._do_run"""
+        source = self.source
+        if source is None or (self.paused and not self.stopping):
+            return
+        data = b"" if self.stopping else source.read()
+        if data:
+            self.clock.frames += 1
+            self.stats.first_frame(self)
+            return
+        with self.clock.lock:
+            self.clock.clients.discard(self)
+        self.source = None
+        after, self.after = self.after, None
+        if after is not None:
+            after(None)  # discord.py : callback after puis cleanup de la source
+        source.cleanup()
+
+class FakeChannel:
+    def __init__(self, guild_id: int, clock: AudioClock, stats: "Stats"):
+        self.id = guild_id
+        self.clock = clock
+        self.stats = stats
+
+    async def connect(self):
+        return FakeVoiceClient(self.clock, self, self.stats)
+
+class FakeGuild:
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+
+class FakeAuthor:
+    def __init__(self, channel):
+        self.voice = type("VoiceState", (), {"channel": channel})()
+
+class FakeMessage:
+    def __init__(self, channel: "FakeTextChannel", message_id: int):
+        self.channel = channel
+        self.id = message_id
+
+    async def edit(self, content=None, **kwargs):
+        self.channel.stats.messages += 1
+
+class FakeTextChannel:
+    """Compte les appels API de messages (envois et modifications)"""
+    def __init__(self, guild_id: int, stats: "Stats"):
+        self.id = guild_id
+        self.stats = stats
+        self.last_message_id = None
+
+    async def send(self, content=None, **kwargs):
+        self.stats.messages += 1
+        self.last_message_id = self.stats.messages
+        return FakeMessage(self, self.last_message_id)
+
+class FakeContext:
+    def __init__(self, guild_id: int, channel: FakeChannel, stats: "Stats"):
+        self.guild = FakeGuild(guild_id)
+        self.author = FakeAuthor(channel)
+        self.channel = FakeTextChannel(guild_id, stats)  # salon des messages du lecteur
+        self.stats = stats
+
+    async def send(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+# --- mesures ---
+
+def percentile(values, p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+def summarize(values, scale: float = 1000.0) -> dict:
+    return {"count": len(values), "p50": percentile(values, 50) * scale, "p95": percentile(values, 95) * scale,
+            "p99": percentile(values, 99) * scale, "max": max(values, default=0.0) * scale}
+
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # Linux : Ko (macOS : octets)
+
+class Stats:
+    def __init__(self):
+        self.latencies = {}  # commande -> [secondes]
+        self.errors = 0
+        self.messages = 0
+        self.requested = {}  # FakeVoiceClient -> instant du premier !play de la guild
+        self.first_audio = []
+        self.loop_lag = []
+
+    def command(self, name: str, seconds: float):
+        self.latencies.setdefault(name, []).append(seconds)
+
+    def first_frame(self, vc):
+        started = self.requested.pop(vc.channel.id, None)
+        if started is not None:
+            self.first_audio.append(time.perf_counter() - started)
+
+# --- scénario ---
+
+COMMAND_MIX = (("play", 0.40), ("playlist", 0.10), ("skip", 0.20), ("queue", 0.30))
+
+async def guild_session(guild_id: int, args, clock: AudioClock, stats: Stats, stop_at: float):
+    channel = FakeChannel(guild_id, clock, stats)
+    ctx = FakeContext(guild_id, channel, stats)
+    commands = {name: multibot.bot.get_command(name) for name, _ in COMMAND_MIX}
+    names, weights = zip(*COMMAND_MIX)
+    await asyncio.sleep(random.uniform(0, args.ramp))
+    first = True
+    while time.perf_counter() < stop_at:
+        name = "play" if first else random.choices(names, weights)[0]
+        kwargs = {}
+        if name == "play":
+            kwargs["query"] = f"https://bench.invalid/track/{random.randrange(args.catalog)}"
+        elif name == "playlist":
+            kwargs["url"] = f"https://bench.invalid/playlist/{random.randrange(max(1, args.catalog // 50))}"
+        if first:
+            stats.requested[guild_id] = time.perf_counter()
+            first = False
+        started = time.perf_counter()
+        try:
+            await commands[name].callback(ctx, **kwargs)
+        except Exception as e:
+            stats.errors += 1
+            if stats.errors <= 5:
+                print(f"erreur {name} (guild {guild_id}) : {e!r}")
+        stats.command(name, time.perf_counter() - started)
+        await asyncio.sleep(random.expovariate(1.0 / args.think))
+
+async def sample_loop_lag(stats: Stats, stop_at: float, interval: float = 0.05):
+    loop = asyncio.get_running_loop()
+    while time.perf_counter() < stop_at:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        stats.loop_lag.append(max(0.0, loop.time() - start - interval))
+
+async def run(args) -> dict:
+    random.seed(args.seed)
+    multibot._extract_info = FakeExtractor(args.resolve_latency, args.track_seconds, args.playlist_size)
+    multibot.open_primed_source = make_source_opener(args.track_seconds, args.spawn_cost)
+    multibot.resolver.max_pending = max(multibot.resolver.max_pending, args.guilds * 4)
+    clock = AudioClock()
+    stats = Stats()
+
+    rss_before = rss_bytes()
+    started = time.perf_counter()
+    stop_at = started + args.ramp + args.duration
+    lag_task = asyncio.create_task(sample_loop_lag(stats, stop_at))
+    await asyncio.gather(*(guild_session(gid, args, clock, stats, stop_at) for gid in range(1, args.guilds + 1)))
+    elapsed = time.perf_counter() - started
+    rss_after = rss_bytes()
+    await lag_task
+
+    guilds = len(multibot.music_manager.bots)
+    for music_bot in list(multibot.music_manager.bots.values()):
+        await music_bot.close()
+    clock.running = False
+
+    total_commands = sum(len(v) for v in stats.latencies.values())
+    return {
+        "params": vars(args),
+        "env": {"python": platform.python_version(), "platform": platform.platform(),
+                "cpus": os.cpu_count(), "git": git_revision()},
+        "at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "elapsed_s": elapsed,
+        "guilds": guilds,
+        "commands": total_commands,
+        "throughput_cmd_s": total_commands / elapsed if elapsed else 0.0,
+        "messages": stats.messages,
+        "messages_per_command": stats.messages / total_commands if total_commands else 0.0,
+        "errors": stats.errors,
+        "extractions": multibot._extract_info.calls,
+        "latency_ms": {name: summarize(v) for name, v in sorted(stats.latencies.items())},
+        "time_to_first_audio_ms": summarize(stats.first_audio),
+        "loop_lag_ms": summarize(stats.loop_lag),
+        "audio_tick_overrun_ms": summarize(clock.overruns),
+        "audio_frames": clock.frames,
+        "rss_mb": rss_after / 2**20,
+        "memory_per_guild_kb": (rss_after - rss_before) / max(1, guilds) / 1024,
+    }
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or "?"
+    except (OSError, subprocess.SubprocessError):
+        return "?"
+
+# --- rapport ---
+
+HEADLINE = (
+    ("throughput_cmd_s", "débit (cmd/s)", True),
+    ("time_to_first_audio_ms.p95", "premier son p95 (ms)", False),
+    ("latency_ms.play.p95", "!play p95 (ms)", False),
+    ("latency_ms.queue.p95", "!queue p95 (ms)", False),
+    ("loop_lag_ms.p99", "retard loop p99 (ms)", False),
+    ("audio_tick_overrun_ms.p99", "retard audio p99 (ms)", False),
+    ("memory_per_guild_kb", "mémoire / guild (Ko)", False),
+    ("messages_per_command", "messages / commande", False),
+)
+
+def lookup(result: dict, path: str):
+    for key in path.split("."):
+        result = result.get(key) if isinstance(result, dict) else None
+    return result
+
+def report(result: dict, baseline: dict = None):
+    print(f"\n{result['guilds']} guilds, {result['commands']} commandes en {result['elapsed_s']:.1f}s "
+          f"({result['errors']} erreurs, {result['extractions']} extractions)")
+    print(f"{'commande':<10} {'n':>7} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}  (ms)")
+    for name, s in result["latency_ms"].items():
+        print(f"{name:<10} {s['count']:>7} {s['p50']:>9.2f} {s['p95']:>9.2f} {s['p99']:>9.2f} {s['max']:>9.2f}")
+    print()
+    for path, label, higher_is_better in HEADLINE:
+        value = lookup(result, path)
+        if value is None:
+            continue
+        line = f"{label:<24} {value:>10.2f}"
+        old = lookup(baseline, path) if baseline else None
+        if old:
+            delta = (value - old) / old * 100
+            better = (delta > 0) == higher_is_better
+            line += f"   (avant {old:.2f}, {delta:+.1f}% {'✓' if better or abs(delta) < 2 else '✗'})"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--guilds", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=30.0, help="secondes de charge après la montée")
+    parser.add_argument("--ramp", type=float, default=5.0, help="étalement (s) de la première commande")
+    parser.add_argument("--think", type=float, default=2.0, help="pause moyenne (s) entre deux commandes")
+    parser.add_argument("--catalog", type=int, default=5000, help="pistes distinctes (taux de hit du cache)")
+    parser.add_argument("--playlist-size", type=int, default=25)
+    parser.add_argument("--track-seconds", type=float, default=8.0)
+    parser.add_argument("--resolve-latency", type=float, default=0.3, help="latence moyenne yt-dlp (s)")
+    parser.add_argument("--spawn-cost", type=float, default=0.01, help="lancement FFmpeg simulé (s)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="fichier JSON (défaut : benchmarks/results/<date>-<rev>-<n>g.json)")
+    parser.add_argument("--compare", help="résultat JSON précédent à comparer")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    report(result, baseline)
+
+    out = args.out or os.path.join(
+        RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{result['env']['git']}-{args.guilds}g.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    print(f"\nRésultat : {out}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""Lance le bot en mode cluster : N process, chacun un AutoShardedBot sur une partie des shards
+
+    python cluster.py
+
+Le superviseur relance un worker qui s'arrête (crash, `kill -TERM <pid du worker>`), et
+redémarre tous les workers un par un sur SIGHUP (`systemctl reload multibot-cluster`) :
+les autres continuent de jouer pendant ce temps. SIGTERM/SIGINT arrêtent tout proprement.
+"""
+import asyncio
+import json
+import os
+import signal
+import sys
+import time
+import urllib.request
+from typing import Dict, List, Optional
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BOT_SCRIPT = os.path.join(HERE, "multibot.py")
+
+CLUSTER_WORKERS = int(os.getenv("CLUSTER_WORKERS", "0")) or os.cpu_count() or 1
+CLUSTER_SHARDS = int(os.getenv("CLUSTER_SHARDS", "0"))  # 0 = nombre recommandé par Discord
+IDENTIFY_DELAY = 5.5  # Discord n'accepte qu'une connexion gateway (IDENTIFY) toutes les 5 s
+STOP_TIMEOUT = 20  # secondes laissées à un worker pour se déconnecter avant SIGKILL
+READY_TIMEOUT = 120  # pendant un redémarrage, attente max avant de passer au worker suivant
+RESTART_BACKOFF_MAX = 60
+READY_MARKER = "est connecté"  # affiché par on_ready dans multibot.py
+TRACK_CACHE_DIR = os.getenv("TRACK_CACHE_DIR", "track_cache")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+WATCHDOG_LOG = os.getenv("WATCHDOG_LOG", "botmusic_blocking.log")
+QUEUE_STORE = os.getenv("QUEUE_STORE", "botmusic_queues.jsonl")
+
+def worker_path(path: str, tag: str) -> str:
+    """« nom.ext » → « nom.<tag>.ext » : un fichier par worker (vide = désactivé, inchangé)"""
+    if not path:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{tag}{ext}"
+
+def shard_tag(shard_ids: List[int]) -> str:
+    """Même nom que le défaut de multibot.py pour ces shards (blocs contigus : premier-dernier)"""
+    return f"s{min(shard_ids)}-{max(shard_ids)}"
+
+def recommended_shards(token: str) -> int:
+    """Nombre de shards conseillé par Discord pour ce bot (GET /gateway/bot)"""
+    req = urllib.request.Request("https://discord.com/api/v10/gateway/bot",
+                                 headers={"Authorization": f"Bot {token}",
+                                          "User-Agent": "DiscordBot (botmusic_python, cluster)"})
+    with urllib.request.urlopen(req, timeout=15) as resp:
+        return int(json.load(resp)["shards"])
+
+def split_shards(shard_count: int, workers: int) -> List[List[int]]:
+    """Répartit les shards en blocs contigus, un par worker (jamais de worker vide)"""
+    workers = max(1, min(workers, shard_count))
+    size, extra = divmod(shard_count, workers)
+    blocks, start = [], 0
+    for i in range(workers):
+        end = start + size + (1 if i < extra else 0)
+        blocks.append(list(range(start, end)))
+        start = end
+    return blocks
+
+class Worker:
+    """Un process multibot.py et les shards qu'il gère"""
+    def __init__(self, index: int, shard_ids: List[int], shard_count: int):
+        self.index = index
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.proc: Optional[asyncio.subprocess.Process] = None
+        self.ready = asyncio.Event()
+        self.restarts = 0
+        self.started_at = 0.0
+
+    def env(self) -> Dict[str, str]:
+        env = dict(os.environ)
+        env["SHARD_COUNT"] = str(self.shard_count)
+        env["SHARD_IDS"] = ",".join(map(str, self.shard_ids))
+        env["CLUSTER_WORKER"] = str(self.index)
+        # index du cache de morceaux en mémoire propre à chaque process : un répertoire chacun
+        env["TRACK_CACHE_DIR"] = os.path.join(TRACK_CACHE_DIR, f"w{self.index}")
+        # journal tournant : la rotation par taille n'est pas sûre entre plusieurs process
+        env["WATCHDOG_LOG"] = worker_path(WATCHDOG_LOG, f"w{self.index}")
+        # files d'attente : un journal par bloc de shards (la compaction réécrit tout le fichier),
+        # retrouvé au redémarrage tant que la répartition ne change pas
+        env["QUEUE_STORE"] = worker_path(QUEUE_STORE, shard_tag(self.shard_ids))
+        if METRICS_PORT:
+            env["METRICS_PORT"] = str(METRICS_PORT + self.index)  # un endpoint par worker
+        env["PYTHONUNBUFFERED"] = "1"
+        return env
+
+    async def start(self):
+        self.ready.clear()
+        self.started_at = time.monotonic()
+        self.proc = await asyncio.create_subprocess_exec(
+            sys.executable, BOT_SCRIPT, cwd=HERE, env=self.env(),
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+        )
+        print(f"[cluster] worker {self.index} démarré (pid {self.proc.pid}, shards {self.shard_ids})")
+        asyncio.create_task(self._relay(self.proc))
+
+    async def _relay(self, proc: asyncio.subprocess.Process):
+        """Recopie la sortie du worker, préfixée, et repère la fin de sa connexion"""
+        async for raw in proc.stdout:
+            line = raw.decode(errors="replace").rstrip()
+            print(f"[w{self.index}] {line}", flush=True)
+            if READY_MARKER in line and proc is self.proc:
+                self.ready.set()
+
+    async def stop(self):
+        proc = self.proc
+        if proc is None or proc.returncode is not None:
+            return
+        proc.terminate()  # SIGTERM : le bot ferme ses connexions vocales et la gateway
+        try:
+            await asyncio.wait_for(proc.wait(), STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            print(f"[cluster] worker {self.index} ne répond pas, SIGKILL")
+            proc.kill()
+            await proc.wait()
+
+class Cluster:
+    def __init__(self, workers: List[Worker]):
+        self.workers = workers
+        self.stopping = False
+        self._restarting = set()  # workers arrêtés volontairement (pas de relance par watch)
+        self._rolling: Optional[asyncio.Task] = None
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        done = asyncio.Event()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, done.set)
+        loop.add_signal_handler(signal.SIGHUP, self.rolling_restart)
+
+        watchers = []
+        for worker in self.workers:
+            await worker.start()
+            watchers.append(asyncio.create_task(self.watch(worker)))
+            await asyncio.sleep(IDENTIFY_DELAY * len(worker.shard_ids))  # connexions gateway étalées
+
+        await done.wait()
+        self.stopping = True
+        print("[cluster] arrêt des workers...")
+        if self._rolling is not None:
+            self._rolling.cancel()
+        await asyncio.gather(*(w.stop() for w in self.workers))
+        for task in watchers:
+            task.cancel()
+
+    async def watch(self, worker: Worker):
+        """Relance le worker s'il s'arrête tout seul, avec un délai croissant s'il crashe en boucle"""
+        backoff = 1.0
+        while True:
+            code = await worker.proc.wait()
+            if self.stopping:
+                return
+            if worker.index in self._restarting:
+                await asyncio.sleep(0.5)  # rolling_restart le relance lui-même
+                continue
+            uptime = time.monotonic() - worker.started_at
+            backoff = 1.0 if uptime > RESTART_BACKOFF_MAX else min(backoff * 2, RESTART_BACKOFF_MAX)
+            print(f"[cluster] worker {worker.index} arrêté (code {code}), relance dans {backoff:.0f}s")
+            await asyncio.sleep(backoff)
+            if self.stopping:
+                return
+            worker.restarts += 1
+            await worker.start()
+
+    def rolling_restart(self):
+        if self._rolling is None or self._rolling.done():
+            self._rolling = asyncio.create_task(self._rolling_restart())
+
+    async def _rolling_restart(self):
+        """Redémarre les workers un à un : le suivant attend que le précédent soit reconnecté"""
+        print("[cluster] redémarrage progressif des workers")
+        for worker in self.workers:
+            if self.stopping:
+                return
+            self._restarting.add(worker.index)
+            try:
+                await worker.stop()
+                worker.restarts += 1
+                await worker.start()
+            finally:
+                self._restarting.discard(worker.index)
+            try:
+                await asyncio.wait_for(worker.ready.wait(), READY_TIMEOUT)
+            except asyncio.TimeoutError:
+                print(f"[cluster] worker {worker.index} pas prêt après {READY_TIMEOUT}s, on continue")
+        print("[cluster] redémarrage terminé")
+
+def main():
+    token = os.getenv("DISCORD_TOKEN", "")
+    if not token:
+        raise SystemExit("Missing DISCORD_TOKEN env var")
+    shard_count = CLUSTER_SHARDS or recommended_shards(token)
+    blocks = split_shards(shard_count, CLUSTER_WORKERS)
+    print(f"[cluster] {shard_count} shard(s) sur {len(blocks)} worker(s)")
+    workers = [Worker(i, ids, shard_count) for i, ids in enumerate(blocks)]
+    asyncio.run(Cluster(workers).run())
+
+if __name__ == "__main__":
+    main()
@@ -68,6 +68,12 @@ class MusicBot:
         """Ajoute un flux (déjà résolu) à la queue"""
         await self.queue.put({"title": title, "url": stream_url})
 
+    def enqueue_many(self, items) -> int:
+        """Ajoute une liste de (title, url) d'un coup (file non bornée : aucune attente)"""
+        for title, stream_url in items:
+            self.queue.put_nowait({"title": title, "url": stream_url})
+        return len(items)
+
     async def resolve_url(self, url: str):
         """Résout un URL (track ou playlist) -> liste d'items (title, url)"""
         results = []
@@ -173,9 +179,8 @@ class MusicBot:
                 await ctx.send("❌ Aucun flux audio trouvé")
                 return
 
-            # Empile tout (si playlist → plusieurs titres)
-            for title, stream_url in items:
-                await self.enqueue_stream(title, stream_url)
+            # Empile tout d'un coup (si playlist → plusieurs titres), un seul message récapitulatif
+            self.enqueue_many(items)
 
             await self.ensure_player(ctx)
             if len(items) == 1:
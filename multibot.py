@@ -1,22 +1,61 @@
 import discord
 from discord.ext import commands
+from discord.oggparse import OggStream
+from aiohttp import web
 import asyncio
+import itertools
+import json
+import logging
+import bisect
+import contextlib
+import hashlib
 import os
+import random
+import re
+import shlex
+import shutil
+import signal
+import sys
+import sqlite3
+import subprocess
+import threading
+import time
+import traceback
+import unicodedata
 import yt_dlp
 import urllib.parse
-from typing import Optional
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import RotatingFileHandler
+from array import array
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+try:
+    import numpy as np  # volume vectorisé ; sans numpy on retombe sur une boucle Python
+except ImportError:
+    np = None
 
 # Configuration du bot
 intents = discord.Intents.default()
 intents.message_content = True
 intents.voice_states = True
-bot = commands.Bot(command_prefix='!', intents=intents)  # si tu veux désactiver l'aide par défaut: help_command=None
+# Mode cluster (cluster.py) : chaque process reçoit le nombre total de shards et ceux qu'il gère
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0"))
+SHARD_IDS = [int(s) for s in os.getenv("SHARD_IDS", "").split(",") if s.strip()]
+if SHARD_COUNT:
+    bot = commands.AutoShardedBot(command_prefix='!', intents=intents,
+                                  shard_count=SHARD_COUNT, shard_ids=SHARD_IDS or None)
+else:
+    bot = commands.Bot(command_prefix='!', intents=intents)  # si tu veux désactiver l'aide par défaut: help_command=None
 
 # Chemin vers FFmpeg - CHANGE CE CHEMIN selon ton installation !
 # Windows: r"C:\ffmpeg\bin\ffmpeg.exe"
 # Si FFmpeg est dans le PATH, laisse None
 FFMPEG_PATH = None  # Change ça si FFmpeg n'est pas dans le PATH
 
+# Cache disque de yt-dlp (client_id SoundCloud, fonctions de signature YouTube...) : survit aux redémarrages
+YTDL_CACHE_DIR = os.getenv("YTDL_CACHE_DIR", "ytdl_cache")  # vide = emplacement par défaut de yt-dlp
+
 # Options pour yt-dlp (gère SoundCloud et autres)
 ydl_opts = {
     'format': 'bestaudio/best',
@@ -30,25 +69,2439 @@ ydl_opts = {
     'quiet': True,
     'no_warnings': True,
 }
+if YTDL_CACHE_DIR:
+    ydl_opts['cachedir'] = YTDL_CACHE_DIR
 
 ffmpeg_options = {
     'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5',
     'options': '-vn'
 }
 
-class MusicBot:
+# Métriques au format texte Prometheus (GET /metrics), sans dépendance supplémentaire
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # 0 = pas d'endpoint
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+
+def _labels_text(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+def _value_text(value: float) -> str:
+    """Valeur exacte (repr) : {:g} ne garde que 6 chiffres significatifs, faux pour les gros compteurs"""
+    value = float(value)
+    if value != value:
+        return "NaN"
+    if value in (float("inf"), float("-inf")):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
+
+class Metric:
+    """Une famille de séries (mêmes nom et type, labels différents) ; modifiable depuis n'importe quel thread"""
+    kind = "untyped"
+
+    def __init__(self, name: str, doc: str):
+        self.name = name
+        self.doc = doc
+        self._values: Dict[Tuple[Tuple[str, str], ...], float] = {}
+        self._lock = threading.Lock()
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, labels, value) for labels, value in self._values.items()]
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{name}{_labels_text(labels)} {_value_text(value)}" for name, labels, value in self.samples()]
+        return lines
+
+class CounterMetric(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+class GaugeMetric(Metric):
+    """Valeur posée par le code, ou calculée au moment du scrape (collect)"""
+    kind = "gauge"
+
+    def __init__(self, name: str, doc: str, collect: Optional[Callable[[], Dict[Tuple, float]]] = None):
+        super().__init__(name, doc)
+        self.collect = collect
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+    def samples(self):
+        if self.collect is None:
+            return super().samples()
+        return [(self.name, labels, value) for labels, value in self.collect().items()]
+
+class CollectedCounter(GaugeMetric):
+    """Compteur déjà tenu ailleurs (stats() d'un cache...) et lu au moment du scrape"""
+    kind = "counter"
+
+class HistogramMetric(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, buckets=LATENCY_BUCKETS):
+        super().__init__(name, doc)
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple[Tuple[str, str], ...], list] = {}  # labels -> [compteurs..., somme, total]
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        out = []
+        with self._lock:
+            for labels, series in self._series.items():
+                for bound, count in zip(self.buckets, series):
+                    out.append((f"{self.name}_bucket", labels + (("le", f"{bound:g}"),), count))
+                out.append((f"{self.name}_bucket", labels + (("le", "+Inf"),), series[-1]))
+                out.append((f"{self.name}_sum", labels, series[-2]))
+                out.append((f"{self.name}_count", labels, series[-1]))
+        return out
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            try:
+                lines += metric.render()
+            except Exception as e:  # une collecte cassée ne doit pas vider tout le scrape
+                print(f"Metrics error ({metric.name}): {e}")
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+RESOLVE_SECONDS = metrics.register(HistogramMetric(
+    "botmusic_resolve_seconds", "Durée des extractions yt-dlp, attente dans le pool comprise"))
+FFMPEG_SPAWNS = metrics.register(CounterMetric(
+    "botmusic_ffmpeg_spawns_total", "Process FFmpeg lancés, par mode (pcm, opus, transcode)"))
+FFMPEG_FAILURES = metrics.register(CounterMetric(
+    "botmusic_ffmpeg_failures_total", "Process FFmpeg en échec (lancement impossible, aucune trame, code != 0)"))
+TIME_TO_FIRST_AUDIO = metrics.register(HistogramMetric(
+    "botmusic_time_to_first_audio_seconds", "Délai entre la mise en file et le début de la lecture, guild inactive"))
+COMMANDS = metrics.register(CounterMetric(
+    "botmusic_commands_total", "Commandes exécutées, par commande et résultat"))
+COMMAND_SECONDS = metrics.register(HistogramMetric(
+    "botmusic_command_seconds", "Durée des commandes"))
+LOOP_LAG = metrics.register(GaugeMetric(
+    "botmusic_event_loop_lag_seconds", "Dernier retard mesuré de l'event loop"))
+LOOP_LAG_SECONDS = metrics.register(HistogramMetric(
+    "botmusic_event_loop_lag_distribution_seconds", "Retards de l'event loop", LAG_BUCKETS))
+LOOP_BLOCKED = metrics.register(CounterMetric(
+    "botmusic_event_loop_blocked_total", "Blocages de l'event loop au-delà du seuil, par commande ou coroutine"))
+LOOP_BLOCKED_SECONDS = metrics.register(HistogramMetric(
+    "botmusic_event_loop_blocked_seconds", "Durée des blocages de l'event loop", LAG_BUCKETS))
+
+# Résolution yt-dlp : jamais sur l'event loop, toujours dans un pool de threads borné
+RESOLVER_WORKERS = int(os.getenv("RESOLVER_WORKERS", "4"))        # extractions simultanées max
+RESOLVER_MAX_PENDING = int(os.getenv("RESOLVER_MAX_PENDING", "64"))  # au-delà on refuse (backpressure)
+RESOLVE_TIMEOUT = float(os.getenv("RESOLVE_TIMEOUT", "45"))        # secondes par extraction
+
+YDL_MAX_USES = 500  # extractions par instance avant de la recréer (état interne qui grossit)
+YDL_WARM_EXTRACTORS = ("Youtube", "YoutubeTab", "Soundcloud", "SoundcloudSet")  # instanciés au démarrage
+
+class YDLPool:
+    """Instances YoutubeDL gardées entre les appels, par jeu d'options
+
+    Une instance garde ses sessions HTTP et ses extracteurs déjà initialisés (client_id
+    SoundCloud...) ; elle n'est utilisée que par un thread à la fois.
+    """
+    def __init__(self, max_idle: int = RESOLVER_WORKERS, max_uses: int = YDL_MAX_USES):
+        self.max_idle = max_idle
+        self.max_uses = max_uses
+        self._lock = threading.Lock()
+        self._idle: Dict[str, List[list]] = {}  # {clé des options: [[ydl, utilisations], ...]}
+        self.created = 0
+        self.reused = 0
+
+    @staticmethod
+    def key(opts: dict) -> str:
+        return json.dumps(opts, sort_keys=True, default=repr)
+
+    def acquire(self, opts: dict) -> list:
+        with self._lock:
+            idle = self._idle.get(self.key(opts))
+            if idle:
+                self.reused += 1
+                return idle.pop()
+            self.created += 1
+        return [yt_dlp.YoutubeDL(dict(opts)), 0]  # construite hors du verrou (chargement des extracteurs)
+
+    def release(self, opts: dict, slot: list, healthy: bool = True, used: bool = True):
+        slot[1] += used
+        if healthy and slot[1] < self.max_uses:
+            with self._lock:
+                idle = self._idle.setdefault(self.key(opts), [])
+                if len(idle) < self.max_idle:
+                    idle.append(slot)
+                    return
+        self._close(slot[0])
+
+    def extract(self, url: str, opts: dict):
+        slot = self.acquire(opts)
+        healthy = False
+        try:
+            info = slot[0].extract_info(url, download=False)
+            healthy = True
+            return info
+        except yt_dlp.utils.DownloadError:
+            healthy = True  # lien privé, indisponible... l'instance reste utilisable
+            raise
+        finally:
+            self.release(opts, slot, healthy)
+
+    def warm(self, opts: dict, count: int = 1):
+        """Crée d'avance des instances (à lancer hors de l'event loop, au démarrage)"""
+        slots = [self.acquire(opts) for _ in range(count)]
+        for slot in slots:
+            for ie_key in YDL_WARM_EXTRACTORS:
+                slot[0].get_info_extractor(ie_key)
+            self.release(opts, slot, used=False)
+
+    def close(self):
+        with self._lock:
+            slots = [slot for idle in self._idle.values() for slot in idle]
+            self._idle.clear()
+        for slot in slots:
+            self._close(slot[0])
+
+    @staticmethod
+    def _close(ydl):
+        try:
+            ydl.close()
+        except Exception as e:
+            print(f"YoutubeDL close error: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            idle = sum(len(v) for v in self._idle.values())
+        return {"idle": idle, "created": self.created, "reused": self.reused}
+
+ydl_pool = YDLPool()
+
+def _extract_info(url: str, opts: dict):
+    """Extraction yt-dlp synchrone (tourne dans un thread du Resolver)"""
+    return ydl_pool.extract(url, opts)
+
+class Resolver:
+    """Pool de threads borné pour yt-dlp : timeout par appel, annulation par guild, stats"""
+    def __init__(self, max_workers: int = RESOLVER_WORKERS, max_pending: int = RESOLVER_MAX_PENDING,
+                 timeout: float = RESOLVE_TIMEOUT):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="resolver")
+        self._lock = threading.Lock()  # compteurs modifiés depuis les threads du pool
+        self.waiting = 0    # soumis mais pas encore pris par un thread
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.cancelled = 0
+        self.rejected = 0
+        self.shared = 0     # demandes servies par une extraction déjà en cours
+        self._guild_calls: Dict[int, Set[asyncio.Future]] = {}
+        self._flights: Dict[str, list] = {}  # {clé: [task, attentes]} extractions partagées
+
+    def _run(self, fn, args):
+        with self._lock:
+            self.waiting -= 1
+            self.running += 1
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self.running -= 1
+
+    def _on_done(self, cfut):
+        # annulé avant d'avoir démarré → _run n'a jamais tourné
+        if cfut.cancelled():
+            with self._lock:
+                self.waiting -= 1
+
+    async def run(self, fn, *args, guild_id: Optional[int] = None, timeout: Optional[float] = None):
+        """Exécute fn(*args) dans le pool et attend le résultat sans bloquer l'event loop"""
+        with self._lock:
+            if self.waiting >= self.max_pending:
+                self.rejected += 1
+                raise RuntimeError("Résolveur saturé, réessaie dans un instant")
+            self.waiting += 1
+        cfut = self.executor.submit(self._run, fn, args)
+        cfut.add_done_callback(self._on_done)
+        fut = asyncio.wrap_future(cfut)
+        started = time.perf_counter()
+
+        calls = self._track(guild_id, fut)
+        try:
+            result = await asyncio.wait_for(fut, timeout or self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            RESOLVE_SECONDS.observe(time.perf_counter() - started, outcome="timeout")
+            raise
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        except Exception:
+            self.failed += 1
+            RESOLVE_SECONDS.observe(time.perf_counter() - started, outcome="error")
+            raise
+        finally:
+            self._untrack(guild_id, calls, fut)
+        self.completed += 1
+        RESOLVE_SECONDS.observe(time.perf_counter() - started, outcome="ok")
+        return result
+
+    def _track(self, guild_id: Optional[int], fut: asyncio.Future) -> Optional[Set[asyncio.Future]]:
+        if guild_id is None:
+            return None
+        calls = self._guild_calls.setdefault(guild_id, set())
+        calls.add(fut)
+        return calls
+
+    def _untrack(self, guild_id: Optional[int], calls: Optional[Set[asyncio.Future]], fut: asyncio.Future):
+        if calls is not None:
+            calls.discard(fut)
+            if not calls and self._guild_calls.get(guild_id) is calls:
+                del self._guild_calls[guild_id]
+
+    async def single_flight(self, key: str, factory: Callable[[], Awaitable], guild_id: Optional[int] = None):
+        """Une seule exécution de factory() par clé à la fois : les appels concurrents partagent son résultat
+
+        L'exécution partagée n'appartient à aucune guild : cancel_guild n'annule que l'attente
+        de cette guild, et l'exécution elle-même seulement quand plus personne ne l'attend.
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = [asyncio.ensure_future(factory()), 0]
+
+            def _landed(_task):
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+
+            flight[0].add_done_callback(_landed)
+        else:
+            self.shared += 1
+        task = flight[0]
+        flight[1] += 1
+        waiter = asyncio.shield(task)
+        calls = self._track(guild_id, waiter)
+        try:
+            return await waiter
+        finally:
+            self._untrack(guild_id, calls, waiter)
+            flight[1] -= 1
+            if flight[1] == 0 and not task.done():
+                # plus personne n'attend : la prochaine demande relancera une extraction neuve
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                task.cancel()
+
+    async def extract(self, url: str, opts: dict, guild_id: Optional[int] = None,
+                      timeout: Optional[float] = None):
+        """extract_info(url, download=False) dans le pool"""
+        return await self.run(_extract_info, url, opts, guild_id=guild_id, timeout=timeout)
+
+    def cancel_guild(self, guild_id: int) -> int:
+        """Annule les extractions en attente d'une guild (ex: !stop)"""
+        calls = self._guild_calls.pop(guild_id, set())
+        for fut in calls:
+            # un thread déjà lancé finit son extraction, mais le résultat est jeté
+            fut.cancel()
+        return len(calls)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.max_workers,
+                "waiting": self.waiting,
+                "running": self.running,
+                "completed": self.completed,
+                "failed": self.failed,
+                "timeouts": self.timeouts,
+                "cancelled": self.cancelled,
+                "rejected": self.rejected,
+                "shared": self.shared,
+            }
+
+resolver = Resolver()
+
+# Cache mémoire des résolutions (clé = URL canonique), expire avec les URLs signées
+RESOLVE_CACHE_SIZE = int(os.getenv("RESOLVE_CACHE_SIZE", "512"))       # entrées max (LRU)
+RESOLVE_CACHE_TTL = float(os.getenv("RESOLVE_CACHE_TTL", "1800"))      # si aucune URL n'a de expire=
+RESOLVE_CACHE_MARGIN = float(os.getenv("RESOLVE_CACHE_MARGIN", "120"))  # on jette un peu avant l'expiration
+
+# options de résolution partagées par !play, !formats et !debug (playlists autorisées)
+# extract_flat : une playlist ne renvoie que page + titre de chaque entrée, le flux est résolu à la lecture
+RESOLVE_OPTS = dict(ydl_opts, noplaylist=False, extract_flat='in_playlist')
+
+_TRACKING_PARAMS = {'si', 'feature', 'ref', 'in', 'utm_source', 'utm_medium', 'utm_campaign',
+                    'utm_content', 'utm_term'}
+_EXPIRE_RE = re.compile(r'[?&/]expires?[=/](\d{9,11})', re.IGNORECASE)
+
+def canonical_url(url: str) -> str:
+    """Normalise un lien pour servir de clé de cache (hôte, paramètres de tracking, youtu.be...)"""
+    parts = urllib.parse.urlsplit(url.strip())
+    host = parts.netloc.lower()
+    for prefix in ("www.", "m."):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+    path = parts.path.rstrip('/') or '/'
+    query = urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+    if host == "youtu.be" and path != '/':
+        host, query = "youtube.com", [("v", path[1:])] + query
+        path = "/watch"
+    query = sorted((k, v) for k, v in query if k not in _TRACKING_PARAMS)
+    return urllib.parse.urlunsplit(("https", host, path, urllib.parse.urlencode(query), ""))
+
+def stream_expiry(stream_url: Optional[str]) -> Optional[float]:
+    """Timestamp d'expiration embarqué dans une URL signée (expire=...), ou None"""
+    if not stream_url:
+        return None
+    m = _EXPIRE_RE.search(stream_url)
+    return float(m.group(1)) if m else None
+
+def _slim_info(info: dict) -> dict:
+    """Garde uniquement ce dont le bot se sert dans la sortie (énorme) d'extract_info"""
+    slim = {k: info.get(k) for k in ("title", "url", "duration", "webpage_url", "acodec", "ext", "abr")}
+    slim["formats"] = [
+        {k: fmt.get(k) for k in ("format_id", "acodec", "ext", "abr", "url")}
+        for fmt in info.get("formats") or []
+    ]
+    if info.get("entries") is not None:
+        slim["entries"] = [
+            {k: entry.get(k) for k in ("title", "url", "duration", "webpage_url")}
+            for entry in info["entries"] if entry
+        ]
+    return slim
+
+class ResolveCache:
+    """LRU en mémoire des extractions ; chaque entrée vit jusqu'à l'expiration de ses URLs signées"""
+    def __init__(self, max_entries: int = RESOLVE_CACHE_SIZE, default_ttl: float = RESOLVE_CACHE_TTL,
+                 margin: float = RESOLVE_CACHE_MARGIN):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.margin = margin
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()  # {url canonique: (deadline, info)}
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+
+    def deadline_for(self, info: dict) -> float:
+        """Date (epoch) à partir de laquelle l'entrée ne doit plus être servie"""
+        urls = [info.get("url")] + [e.get("url") for e in info.get("entries") or []]
+        expiries = [exp for exp in map(stream_expiry, urls) if exp is not None]
+        if not expiries:
+            return time.time() + self.default_ttl
+        return min(expiries) - self.margin
+
+    def get(self, url: str) -> Optional[dict]:
+        key = canonical_url(url)
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        deadline, info = entry
+        if deadline <= time.time():
+            del self._data[key]
+            self.expired += 1
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return info
+
+    def put(self, url: str, info: dict):
+        deadline = self.deadline_for(info)
+        if deadline <= time.time():
+            return  # URLs déjà (presque) mortes : inutile de les garder
+        key = canonical_url(url)
+        self._data[key] = (deadline, info)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def ttl_left(self, url: str) -> Optional[float]:
+        entry = self._data.get(canonical_url(url))
+        return entry[0] - time.time() if entry else None
+
+    def stats(self) -> dict:
+        return {"entries": len(self._data), "hits": self.hits, "misses": self.misses, "expired": self.expired}
+
+resolve_cache = ResolveCache()
+
+# Métadonnées stables persistées sur disque (survivent aux redémarrages systemd)
+METADATA_DB = os.getenv("METADATA_DB", "botmusic_meta.sqlite3")
+METADATA_MAX_ROWS = int(os.getenv("METADATA_MAX_ROWS", "20000"))  # au-delà, éviction des moins récemment utilisés
+METADATA_WARM_ROWS = int(os.getenv("METADATA_WARM_ROWS", "500"))   # lignes les plus demandées préchargées au démarrage
+METADATA_PLAYLIST_MAX_AGE = float(os.getenv("METADATA_PLAYLIST_MAX_AGE", "3600"))  # contenu relu sur le réseau au-delà
+METADATA_BUSY_TIMEOUT = 5.0  # attente max du verrou SQLite (base partagée par les process du cluster)
+
+def _stable_info(info: dict) -> dict:
+    """Partie durable d'une extraction : tout sauf les URLs de flux signées"""
+    stable = {k: info.get(k) for k in ("title", "duration", "webpage_url", "acodec", "ext", "abr")}
+    stable["url"] = None  # à rafraîchir à la demande
+    stable["formats"] = [{k: fmt.get(k) for k in ("format_id", "acodec", "ext", "abr")}
+                         for fmt in info.get("formats") or []]
+    if info.get("entries") is not None:
+        stable["entries"] = [
+            {"title": e.get("title"), "url": e.get("webpage_url") or e.get("url"), "duration": e.get("duration")}
+            for e in info["entries"]
+        ]
+    return stable
+
+def _info_kind(info: dict) -> str:
+    return "playlist" if info.get("entries") is not None else "track"
+
+class MetadataStore:
+    """Store SQLite (titre, durée, formats, contenu des playlists), borné avec éviction LRU"""
+    def __init__(self, path: str = METADATA_DB, max_rows: int = METADATA_MAX_ROWS,
+                 warm_rows: int = METADATA_WARM_ROWS, playlist_max_age: float = METADATA_PLAYLIST_MAX_AGE):
+        self.path = path
+        self.max_rows = max_rows
+        self.warm_rows = warm_rows
+        self.playlist_max_age = playlist_max_age
+        # un seul thread : toutes les requêtes SQLite sont sérialisées hors de l'event loop
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="metadata")
+        self._db: Optional[sqlite3.Connection] = None
+        self._hot: Dict[str, tuple] = {}  # lignes préchargées par warm() : {url: (kind, updated, info)}
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            # timeout = busy timeout : les autres workers du cluster écrivent dans la même base
+            db = sqlite3.connect(self.path, timeout=METADATA_BUSY_TIMEOUT, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS items ("
+                " url TEXT PRIMARY KEY, kind TEXT NOT NULL, data TEXT NOT NULL,"
+                " hits INTEGER NOT NULL DEFAULT 0, last_access REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS items_last_access ON items(last_access)")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS local_files ("
+                " path TEXT PRIMARY KEY, mtime REAL NOT NULL, size INTEGER NOT NULL, data TEXT NOT NULL)"
+            )
+            self._db = db
+        return self._db
+
+    def _servable(self, kind: str, updated: float, info: dict) -> bool:
+        """Une playlist change : relue sur le réseau passé un âge max. Un track sans format audio
+        ne donnerait aucun flux : mieux vaut l'extraire de nouveau."""
+        if kind == "playlist":
+            return time.time() - updated <= self.playlist_max_age
+        return any(fmt.get("acodec") != "none" for fmt in info.get("formats") or ())
+
+    def _load(self, key: str) -> Optional[dict]:
+        # une base indisponible (verrouillée, corrompue) n'est qu'un miss : on passera par le réseau
+        try:
+            row = self._conn().execute("SELECT kind, updated, data FROM items WHERE url = ?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            print(f"MetadataStore error: {e}")
+            return None
+        if row is None:
+            return None
+        kind, updated, data = row
+        info = json.loads(data)
+        if not self._servable(kind, updated, info):
+            return None  # la ligne sera remplacée par la nouvelle extraction
+        self._touch(key)
+        return info
+
+    def _touch(self, key: str):
+        try:
+            db = self._conn()
+            db.execute("UPDATE items SET hits = hits + 1, last_access = ? WHERE url = ?", (time.time(), key))
+            db.commit()
+        except sqlite3.Error as e:
+            print(f"MetadataStore error: {e}")
+
+    def _save(self, key: str, info: dict):
+        try:
+            db = self._conn()
+            now = time.time()
+            kind = _info_kind(info)
+            db.execute(
+                "INSERT INTO items (url, kind, data, hits, last_access, updated) VALUES (?, ?, ?, 1, ?, ?) "
+                "ON CONFLICT(url) DO UPDATE SET kind = excluded.kind, data = excluded.data, "
+                "hits = hits + 1, last_access = excluded.last_access, updated = excluded.updated",
+                (key, kind, json.dumps(info), now, now),
+            )
+            (count,) = db.execute("SELECT COUNT(*) FROM items").fetchone()
+            if count > self.max_rows:
+                cur = db.execute(
+                    "DELETE FROM items WHERE url IN (SELECT url FROM items ORDER BY last_access LIMIT ?)",
+                    (count - self.max_rows,),
+                )
+                self.evicted += cur.rowcount
+            db.commit()
+        except sqlite3.Error as e:
+            print(f"MetadataStore error: {e}")
+
+    def _warm(self) -> Dict[str, dict]:
+        try:
+            rows = self._conn().execute(
+                "SELECT url, kind, updated, data FROM items ORDER BY hits DESC LIMIT ?", (self.warm_rows,)
+            ).fetchall()
+        except sqlite3.Error as e:
+            print(f"MetadataStore error: {e}")
+            return {}
+        return {url: (kind, updated, json.loads(data)) for url, kind, updated, data in rows}
+
+    async def warm(self):
+        """Précharge les playlists/tracks les plus demandées (aucun accès réseau)"""
+        loop = asyncio.get_running_loop()
+        self._hot = await loop.run_in_executor(self.executor, self._warm)
+        print(f"MetadataStore: {len(self._hot)} entrées préchargées depuis {self.path}")
+
+    async def get(self, url: str) -> Optional[dict]:
+        key = canonical_url(url)
+        hot = self._hot.get(key)
+        if hot is not None:
+            info = hot[2] if self._servable(*hot) else None
+            if info is not None:
+                self.executor.submit(self._touch, key)
+        else:
+            loop = asyncio.get_running_loop()
+            info = await loop.run_in_executor(self.executor, self._load, key)
+        if info is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return info
+
+    def remember(self, url: str, info: dict):
+        """Persiste la partie stable d'une extraction (écriture en arrière-plan, sans attendre)"""
+        key = canonical_url(url)
+        stable = _stable_info(info)
+        if key in self._hot:
+            self._hot[key] = (_info_kind(stable), time.time(), stable)
+        self.executor.submit(self._save, key, stable)
+
+    def _load_local(self) -> Dict[str, tuple]:
+        try:
+            rows = self._conn().execute("SELECT path, mtime, size, data FROM local_files").fetchall()
+        except sqlite3.Error as e:
+            print(f"MetadataStore error: {e}")
+            return {}  # tout sera sondé de nouveau
+        return {path: (mtime, size, json.loads(data)) for path, mtime, size, data in rows}
+
+    def _save_local(self, rows: List[tuple]):
+        try:
+            db = self._conn()
+            db.executemany("INSERT OR REPLACE INTO local_files (path, mtime, size, data) VALUES (?, ?, ?, ?)",
+                           [(path, mtime, size, json.dumps(meta)) for path, mtime, size, meta in rows])
+            db.commit()
+        except sqlite3.Error as e:
+            print(f"MetadataStore error: {e}")
+
+    async def load_local(self) -> Dict[str, tuple]:
+        """Métadonnées ffprobe des fichiers locaux : {chemin: (mtime, taille, meta)}"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._load_local)
+
+    def save_local(self, rows: List[tuple]):
+        """Persiste un lot [(chemin, mtime, taille, meta)] en une transaction (sans attendre)"""
+        self.executor.submit(self._save_local, rows)
+
+    def stats(self) -> dict:
+        return {"hot": len(self._hot), "hits": self.hits, "misses": self.misses, "evicted": self.evicted}
+
+metadata_store = MetadataStore()
+
+async def extract_cached(url: str, guild_id: Optional[int] = None, need_stream: bool = True) -> Optional[dict]:
+    """extract_info (track ou playlist) servi par le cache mémoire, sinon par le Resolver
+
+    Si need_stream est faux (titre, durée, formats suffisent), le store disque est consulté
+    avant le réseau.
+    """
+    info = resolve_cache.get(url)
+    if info is None and not need_stream:
+        info = await metadata_store.get(url)
+    if info is None:
+        # même lien demandé par plusieurs guilds en même temps : une seule extraction
+        info = await resolver.single_flight(canonical_url(url), lambda: _fetch_info(url), guild_id)
+    return info
+
+async def _fetch_info(url: str) -> Optional[dict]:
+    raw = await resolver.extract(url, RESOLVE_OPTS)
+    if raw is None:
+        return None
+    info = _slim_info(raw)
+    resolve_cache.put(url, info)
+    metadata_store.remember(url, info)
+    return info
+
+# Bibliothèque locale : indexée une fois, puis rescannée par mtime de dossier et de fichier
+MUSIC_DIRS = [d for d in os.getenv("MUSIC_DIRS", "music").split(os.pathsep) if d]
+AUDIO_EXTENSIONS = ('.mp3', '.wav', '.m4a', '.flac', '.ogg', '.opus')
+LIBRARY_RESCAN_INTERVAL = float(os.getenv("LIBRARY_RESCAN_INTERVAL", "300"))  # secondes
+LIBRARY_MIN_SCORE = 0.3  # similarité minimale (trigrammes) pour une correspondance approximative
+
+def normalize_name(name: str) -> str:
+    """Nom de fichier → clé de recherche (sans extension, accents ni ponctuation)"""
+    name = os.path.splitext(os.path.basename(name))[0]
+    name = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode()
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", name.lower()).split())
+
+def _trigrams(key: str) -> Set[str]:
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class LibraryIndex:
+    """Index en mémoire des fichiers audio locaux (préfixe + trigrammes pour les fautes de frappe)
+
+    Le premier scan est récursif ; les suivants ne relisent que les dossiers dont le mtime a
+    changé (un stat par dossier au lieu d'un listdir) et relèvent mtime et taille des fichiers
+    déjà connus : un fichier réécrit sur place est ainsi sondé de nouveau. Les chemins sont
+    indexés sous leur forme canonique (os.path.realpath), la même qu'utilisent les recherches.
+    """
+    def __init__(self, roots: List[str] = MUSIC_DIRS):
+        self.roots = roots
+        self._dirs: Dict[str, Tuple[float, List[tuple], List[str]]] = {}  # {dossier: (mtime, fichiers, sous-dossiers)}
+        self._keys: Dict[str, str] = {}             # {chemin: clé normalisée}
+        self._stats: Dict[str, Tuple[float, int]] = {}  # {chemin: (mtime, taille)}
+        self._sorted: List[Tuple[str, str]] = []    # [(clé, chemin)] trié, pour préfixes et pages
+        self._trigram_index: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()  # refresh() tourne dans un thread, les recherches sur la loop
+        self.last_refresh = 0.0
+        self.rescan_task: Optional[asyncio.Task] = None
+        self.on_change = None  # appelé (sur la loop) quand des fichiers apparaissent/disparaissent
+
+    @staticmethod
+    def _list_dir(path: str) -> Tuple[List[tuple], List[str]]:
+        files, subdirs = [], []
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.name.lower().endswith(AUDIO_EXTENSIONS):
+                        st = entry.stat()
+                        # dossier parent déjà canonique : seul un lien symbolique change le chemin
+                        path = os.path.realpath(entry.path) if entry.is_symlink() else entry.path
+                        files.append((path, st.st_mtime, st.st_size))
+        except OSError:
+            pass
+        return files, subdirs
+
+    @staticmethod
+    def _restat(files: List[tuple]) -> List[tuple]:
+        """Fichiers d'un dossier inchangé : un fichier modifié sur place ne touche pas le mtime du dossier"""
+        fresh = []
+        for path, _, _ in files:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            fresh.append((path, st.st_mtime, st.st_size))
+        return fresh
+
+    def resolve_path(self, query: str) -> Optional[str]:
+        """Chemin explicite (« dossier/titre », extension .mp3 facultative), limité aux dossiers de la
+        bibliothèque : ni chemin absolu ailleurs, ni « .. », ni fichier qui ne soit pas de l'audio"""
+        roots = [os.path.realpath(root) for root in self.roots]
+        candidates = [query] + [os.path.join(root, query) for root in self.roots]
+        for path in candidates + [p + '.mp3' for p in candidates]:
+            real = os.path.realpath(path)
+            if not real.lower().endswith(AUDIO_EXTENSIONS) or not os.path.isfile(real):
+                continue
+            if any(os.path.commonpath([real, root]) == root for root in roots):
+                return path
+        return None
+
+    def refresh(self) -> int:
+        """Rescan incrémental (bloquant : à lancer hors de l'event loop), renvoie le nb de changements"""
+        dirs = {}
+        stack = list(dict.fromkeys(os.path.realpath(root) for root in self.roots if os.path.isdir(root)))
+        while stack:
+            path = stack.pop()
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                continue
+            entry = self._dirs.get(path)
+            if entry is None or entry[0] != mtime:
+                entry = (mtime, *self._list_dir(path))
+            else:
+                entry = (mtime, self._restat(entry[1]), entry[2])
+            dirs[path] = entry
+            stack.extend(entry[2])
+
+        stats = {f[0]: (f[1], f[2]) for _, dir_files, _ in dirs.values() for f in dir_files}
+        files = stats.keys()
+        with self._lock:
+            modified = [f for f, st in stats.items() if f in self._stats and self._stats[f] != st]
+            self._stats = stats
+            removed = [f for f in self._keys if f not in files]
+            added = [f for f in files if f not in self._keys]
+            for path in removed:
+                for tri in _trigrams(self._keys.pop(path)):
+                    paths = self._trigram_index.get(tri)
+                    if paths is not None:
+                        paths.discard(path)
+                        if not paths:
+                            del self._trigram_index[tri]
+            for path in added:
+                key = normalize_name(path)
+                self._keys[path] = key
+                for tri in _trigrams(key):
+                    self._trigram_index.setdefault(tri, set()).add(path)
+            if removed or added:
+                self._sorted = sorted((key, path) for path, key in self._keys.items())
+            self._dirs = dirs
+            self.last_refresh = time.time()
+        return len(removed) + len(added) + len(modified)
+
+    async def refresh_async(self) -> int:
+        loop = asyncio.get_running_loop()
+        changes = await loop.run_in_executor(None, self.refresh)
+        if self.on_change is not None:
+            self.on_change()
+        return changes
+
+    def stat(self, path: str) -> Optional[Tuple[float, int]]:
+        """(mtime, taille) relevés au dernier scan, sans toucher au disque (chemin canonique)"""
+        return self._stats.get(path)
+
+    def files(self) -> List[Tuple[str, float, int]]:
+        with self._lock:
+            return [(path, mtime, size) for path, (mtime, size) in self._stats.items()]
+
+    def start(self):
+        """Lance les rescans périodiques en arrière-plan"""
+        if self.rescan_task is None or self.rescan_task.done():
+            self.rescan_task = asyncio.create_task(self.rescan_forever())
+
+    async def rescan_forever(self, interval: float = LIBRARY_RESCAN_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                changes = await self.refresh_async()
+                if changes:
+                    print(f"Bibliothèque : {changes} fichier(s) ajouté(s)/retiré(s)/modifié(s), {len(self)} au total")
+            except Exception as e:
+                print(f"Library rescan error: {e}")
+
+    def __len__(self) -> int:
+        return len(self._sorted)
+
+    def search(self, query: str, limit: int = 5) -> List[Tuple[str, float]]:
+        """[(chemin, score)] du plus au moins probable ; score 1.0 = nom exact"""
+        key = normalize_name(query)
+        if not key:
+            return []
+        with self._lock:
+            sorted_keys = self._sorted
+            results: Dict[str, float] = {}
+            # noms qui commencent par la requête (bisect sur la liste triée)
+            i = bisect.bisect_left(sorted_keys, (key, ""))
+            while i < len(sorted_keys) and sorted_keys[i][0].startswith(key) and len(results) < limit:
+                name, path = sorted_keys[i]
+                results[path] = 1.0 if name == key else 0.9
+                i += 1
+            # tolérance aux fautes : trigrammes en commun
+            query_tris = _trigrams(key)
+            shared = Counter()
+            for tri in query_tris:
+                shared.update(self._trigram_index.get(tri, ()))
+            for path, count in shared.most_common(limit * 4):
+                score = count / max(len(query_tris), len(_trigrams(self._keys[path])))
+                if score >= LIBRARY_MIN_SCORE and path not in results:
+                    results[path] = min(score, 0.89)
+        return sorted(results.items(), key=lambda r: -r[1])[:limit]
+
+    def page(self, page: int, size: int) -> List[str]:
+        with self._lock:
+            return [path for _, path in self._sorted[(page - 1) * size:page * size]]
+
+library = LibraryIndex()
+
+# Métadonnées des fichiers locaux : ffprobe en tâche de fond, jamais au moment de jouer
+FFPROBE_PATH = os.path.join(os.path.dirname(FFMPEG_PATH), "ffprobe") if FFMPEG_PATH else "ffprobe"
+PROBE_CONCURRENCY = int(os.getenv("PROBE_CONCURRENCY", "4"))  # ffprobe simultanés
+PROBE_BATCH = 100  # résultats écrits en base par transaction
+
+def parse_probe(data: dict) -> dict:
+    """Sortie JSON de ffprobe → durée, codec, fréquence, débit, tags utiles"""
+    fmt = data.get("format") or {}
+    audio = next((st for st in data.get("streams") or [] if st.get("codec_type") == "audio"), {})
+    tags = {k.lower(): v for k, v in {**(fmt.get("tags") or {}), **(audio.get("tags") or {})}.items()}
+
+    def _num(value, cast):
+        try:
+            return cast(value) or None
+        except (TypeError, ValueError):
+            return None
+
+    return {
+        "duration": _num(fmt.get("duration") or audio.get("duration"), float),
+        "codec": audio.get("codec_name"),
+        "sample_rate": _num(audio.get("sample_rate"), int),
+        "bitrate": _num(audio.get("bit_rate") or fmt.get("bit_rate"), int),
+        "tags": {k: tags[k] for k in ("title", "artist", "album", "date", "genre") if k in tags},
+    }
+
+class LocalProbeCache:
+    """Cache des métadonnées ffprobe, clé (chemin, mtime, taille), persisté dans le MetadataStore"""
+    def __init__(self, store: MetadataStore, concurrency: int = PROBE_CONCURRENCY):
+        self.store = store
+        self.concurrency = concurrency
+        self._meta: Dict[str, tuple] = {}  # {chemin: (mtime, taille, meta)}
+        self.task: Optional[asyncio.Task] = None
+        self._rerun = False
+        self.on_done = None  # appelé quand une passe de sondage se termine
+        self.probed = 0
+        self.failed = 0
+
+    async def load(self):
+        self._meta = await self.store.load_local()
+
+    def update(self, path: str, mtime: float, size: int, meta: dict):
+        self._meta[path] = (mtime, size, meta)
+        self.store.save_local([(path, mtime, size, meta)])
+
+    def get(self, path: str, mtime: float, size: int) -> Optional[dict]:
+        entry = self._meta.get(path)
+        if entry is None or entry[0] != mtime or entry[1] != size:
+            return None
+        return entry[2]
+
+    def lookup(self, path: str) -> Optional[dict]:
+        """Métadonnées d'un fichier de la bibliothèque (ni ffprobe ni lecture : le chemin est
+        seulement rendu canonique, comme à l'indexation)"""
+        path = os.path.realpath(path)
+        st = library.stat(path)
+        return self.get(path, *st) if st else None
+
+    def schedule(self):
+        """Sonde en arrière-plan les fichiers nouveaux ou modifiés"""
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.probe_pending())
+        else:
+            self._rerun = True
+
+    async def probe_pending(self):
+        if shutil.which(FFPROBE_PATH) is None:
+            print(f"ffprobe introuvable ({FFPROBE_PATH}) : métadonnées locales désactivées")
+            return
+        while True:
+            self._rerun = False
+            pending = [(path, mtime, size) for path, mtime, size in library.files()
+                       if self.get(path, mtime, size) is None]
+            if pending:
+                await self._probe_batch(pending)
+            if not self._rerun:
+                break
+        if self.on_done is not None:
+            self.on_done()
+
+    async def _probe_batch(self, files: List[tuple]):
+        sem = asyncio.Semaphore(self.concurrency)
+        done: List[tuple] = []
+
+        async def _one(path, mtime, size):
+            async with sem:
+                meta = await self.probe(path)
+            if meta is None:
+                self.failed += 1
+                return
+            self.probed += 1
+            self._meta[path] = (mtime, size, meta)
+            done.append((path, mtime, size, meta))
+            if len(done) >= PROBE_BATCH:
+                self.store.save_local(done[:])
+                done.clear()
+
+        await asyncio.gather(*(_one(*f) for f in files))
+        if done:
+            self.store.save_local(done)
+        print(f"ffprobe : {self.probed} fichier(s) analysé(s), {self.failed} échec(s)")
+
+    @staticmethod
+    async def probe(path: str) -> Optional[dict]:
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                FFPROBE_PATH, "-v", "quiet", "-print_format", "json", "-show_format", "-show_streams", path,
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL,
+            )
+            out, _ = await proc.communicate()
+        except OSError as e:
+            print(f"ffprobe error ({path}): {e}")
+            return None
+        if proc.returncode != 0:
+            return None
+        try:
+            return parse_probe(json.loads(out or b"{}"))
+        except ValueError:
+            return None
+
+local_probes = LocalProbeCache(metadata_store)
+
+# Cache Opus des fichiers locaux : transcodés une fois en Ogg Opus 48 kHz, rangés par hash du contenu
+OPUS_CACHE = os.getenv("OPUS_CACHE", "0") == "1"          # transcodage automatique après l'indexation
+OPUS_CACHE_DIR = os.getenv("OPUS_CACHE_DIR", "opus_cache")
+TRANSCODE_CONCURRENCY = int(os.getenv("TRANSCODE_CONCURRENCY", "2"))
+OPUS_BITRATE = os.getenv("OPUS_BITRATE", "128k")
+
+def file_sha256(path: str) -> str:
+    """Hash du contenu d'un fichier (bloquant : à lancer hors de l'event loop)"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class OggOpusFileSource(discord.AudioSource):
+    """Paquets Opus lus directement dans un fichier Ogg : ni FFmpeg, ni décodage, ni encodage"""
+    def __init__(self, path: str):
+        self._file = open(path, 'rb')
+        self._packets = OggStream(self._file).iter_packets()
+
+    def read(self) -> bytes:
+        for packet in self._packets:
+            if not packet.startswith((b'OpusHead', b'OpusTags')):  # en-têtes Ogg Opus
+                return packet
+        return b''
+
+    def is_opus(self) -> bool:
+        return True
+
+    def cleanup(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+class OpusCache:
+    """Répertoire adressé par contenu ({sha256}.opus) des fichiers locaux pré-transcodés"""
+    def __init__(self, directory: str = OPUS_CACHE_DIR, concurrency: int = TRANSCODE_CONCURRENCY):
+        self.directory = directory
+        self._root = os.path.abspath(directory)
+        self.concurrency = concurrency
+        self._available: Set[str] = set()  # hashes déjà transcodés
+        self.task: Optional[asyncio.Task] = None
+        self._rerun = False
+        self.transcoded = 0
+        self.failed = 0
+
+    def path_for(self, digest: str) -> str:
+        return os.path.join(self.directory, digest[:2], f"{digest}.opus")
+
+    def contains(self, path: str) -> bool:
+        return os.path.abspath(path).startswith(self._root + os.sep)
+
+    def lookup(self, meta: dict) -> Optional[str]:
+        """Chemin du .opus pour un fichier sondé, s'il est déjà transcodé (aucun accès disque)"""
+        digest = meta.get("sha256")
+        return self.path_for(digest) if digest in self._available else None
+
+    def _scan(self) -> Set[str]:
+        found = set()
+        for _, _, names in os.walk(self.directory):
+            found.update(name[:-5] for name in names if name.endswith(".opus"))
+        return found
+
+    async def load(self):
+        loop = asyncio.get_running_loop()
+        self._available = await loop.run_in_executor(None, self._scan)
+
+    def schedule(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.transcode_pending())
+        else:
+            self._rerun = True
+
+    async def transcode_pending(self):
+        ffmpeg = FFMPEG_PATH or "ffmpeg"
+        if shutil.which(ffmpeg) is None:
+            print(f"FFmpeg introuvable ({ffmpeg}) : cache Opus désactivé")
+            return
+        loop = asyncio.get_running_loop()
+        sem = asyncio.Semaphore(self.concurrency)
+
+        async def _one(path, mtime, size, meta):
+            async with sem:
+                if not meta.get("sha256"):
+                    meta = dict(meta, sha256=await loop.run_in_executor(None, file_sha256, path))
+                    local_probes.update(path, mtime, size, meta)
+                if meta["sha256"] in self._available:
+                    return  # même contenu déjà transcodé (doublon, fichier renommé...)
+                if await self.transcode(path, meta["sha256"]):
+                    self.transcoded += 1
+                else:
+                    self.failed += 1
+
+        while True:
+            self._rerun = False
+            pending = []
+            for path, mtime, size in library.files():
+                meta = local_probes.get(path, mtime, size)
+                if meta is not None and not self.lookup(meta):
+                    pending.append((path, mtime, size, meta))
+            await asyncio.gather(*(_one(*p) for p in pending))
+            if not self._rerun:
+                break
+        print(f"Cache Opus : {len(self._available)} fichier(s), {self.transcoded} transcodé(s), "
+              f"{self.failed} échec(s)")
+
+    async def transcode(self, src: str, digest: str) -> bool:
+        dst = self.path_for(digest)
+        if os.path.exists(dst):  # transcodé entre-temps par un autre process du cluster
+            self._available.add(digest)
+            return True
+        tmp = f"{dst}.{os.getpid()}.part"
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        loop = asyncio.get_running_loop()
+        rec = await ffmpeg_supervisor.reserve(None, "transcode")
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                FFMPEG_PATH or "ffmpeg", "-nostdin", "-y", "-loglevel", "error", "-i", src,
+                "-vn", "-map_metadata", "-1", "-c:a", "libopus", "-b:a", OPUS_BITRATE, "-ar", "48000", "-ac", "2",
+                "-frame_duration", "20", "-application", "audio", "-f", "ogg", tmp,
+                stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.DEVNULL,
+            )
+            ffmpeg_supervisor.attach(rec, proc)
+            FFMPEG_SPAWNS.inc(mode="transcode")
+            returncode = await proc.wait()
+        finally:
+            ffmpeg_supervisor.release(rec)
+        if returncode != 0:
+            FFMPEG_FAILURES.inc(mode="transcode")
+            with contextlib.suppress(OSError):
+                os.remove(tmp)
+            return False
+        os.replace(tmp, dst)  # le .opus n'apparaît qu'une fois complet
+        self._available.add(digest)
+        return True
+
+opus_cache = OpusCache()
+
+def format_duration(seconds: Optional[float]) -> str:
+    if not seconds:
+        return "?:??"
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+def make_track(title: str, url: Optional[str] = None, page_url: Optional[str] = None,
+               duration: Optional[float] = None, acodec: Optional[str] = None) -> dict:
+    """Item de queue : url = flux jouable (peut manquer), page_url = lien d'origine pour le résoudre"""
+    return {"title": title, "url": url, "page_url": page_url, "duration": duration,
+            "expires": stream_expiry(url), "resolved_at": time.time() if url else None, "acodec": acodec}
+
+def stream_deadline(item: dict) -> Optional[float]:
+    """Date (epoch) où le flux de l'item cesse d'être fiable ; None = jamais (fichier local)
+
+    Sans expire= dans l'URL (CDN signés autrement, extracteurs génériques), même règle que
+    ResolveCache : RESOLVE_CACHE_TTL après la résolution.
+    """
+    if item.get("expires") is not None:
+        return item["expires"]
+    if item.get("resolved_at") is not None:
+        return item["resolved_at"] + RESOLVE_CACHE_TTL
+    return None
+
+class TrackQueue:
+    """File d'une guild : ajout/retrait en tête O(1), lecture fenêtrée, retrait/déplacement indexés"""
     def __init__(self):
+        self._items = deque()
+        self._not_empty = asyncio.Event()
+        self.on_change: Optional[Callable[[], None]] = None  # appelé à chaque modification (persistance)
+
+    def _changed(self):
+        if self.on_change is not None:
+            self.on_change()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def empty(self) -> bool:
+        return not self._items
+
+    def append(self, item: dict):
+        self._items.append(item)
+        self._not_empty.set()
+        self._changed()
+
+    def appendleft(self, item: dict):
+        """Remet un item en tête (morceau amorcé puis abandonné)"""
+        self._items.appendleft(item)
+        self._not_empty.set()
+        self._changed()
+
+    def extend(self, items: List[dict]):
+        """Ajout groupé : une seule notification, quelle que soit la taille du lot"""
+        if not items:
+            return
+        self._items.extend(items)
+        self._not_empty.set()
+        self._changed()
+
+    def popleft(self) -> dict:
+        item = self._items.popleft()
+        if not self._items:
+            self._not_empty.clear()
+        self._changed()
+        return item
+
+    async def get(self) -> dict:
+        """Attend qu'un item soit disponible puis le retire"""
+        while not self._items:
+            await self._not_empty.wait()
+        return self.popleft()
+
+    def peek(self, start: int = 0, count: int = 15) -> list:
+        """Fenêtre [start, start+count) sans toucher à la file"""
+        return list(itertools.islice(self._items, start, start + count))
+
+    def remove(self, index: int) -> dict:
+        item = self._items[index]
+        del self._items[index]
+        if not self._items:
+            self._not_empty.clear()
+        self._changed()
+        return item
+
+    def move(self, src: int, dst: int) -> dict:
+        item = self._items[src]
+        del self._items[src]
+        self._items.insert(dst, item)
+        self._changed()
+        return item
+
+    def jump(self, index: int) -> int:
+        """Retire tout ce qui précède index (qui devient la tête), renvoie le nombre retiré"""
+        if index < 0 or index >= len(self._items):
+            raise IndexError(index)
+        for _ in range(index):
+            self._items.popleft()
+        self._changed()
+        return index
+
+    def shuffle(self):
+        items = list(self._items)
+        random.shuffle(items)
+        self._items = deque(items)
+        self._changed()
+
+    def clear(self) -> int:
+        count = len(self._items)
+        self._items.clear()
+        self._not_empty.clear()
+        self._changed()
+        return count
+
+# Enchaînement sans blanc : le morceau suivant est lancé et amorcé avant la fin du courant
+GAPLESS = os.getenv("GAPLESS", "1") != "0"
+GAPLESS_LEAD = float(os.getenv("GAPLESS_LEAD", "5"))  # secondes avant la fin pour lancer le suivant
+PRIME_FRAMES = int(os.getenv("PRIME_FRAMES", "50"))   # trames (20 ms) lues d'avance à l'ouverture
+FRAME_SECONDS = 0.02
+
+# Flux déjà en Opus (YouTube/SoundCloud) : envoyés tels quels à Discord, sans passer par le PCM
+OPUS_PASSTHROUGH = os.getenv("OPUS_PASSTHROUGH", "1") != "0"
+
+class PrimedSource(discord.AudioSource):
+    """Source FFmpeg dont les premières trames sont déjà en mémoire : démarrage instantané"""
+    def __init__(self, original: discord.AudioSource):
+        self.original = original
+        self.buffer = deque()
+
+    def prime(self, frames: int) -> "PrimedSource":
+        for _ in range(frames):
+            data = self.original.read()
+            if not data:
+                break
+            self.buffer.append(data)
+        return self
+
+    def read(self) -> bytes:
+        if self.buffer:
+            return self.buffer.popleft()
+        return self.original.read()
+
+    def is_opus(self) -> bool:
+        return self.original.is_opus()
+
+    @property
+    def _current_error(self):
+        # lu par AudioPlayer pour remonter les erreurs FFmpeg
+        return getattr(self.original, '_current_error', None)
+
+    def cleanup(self):
+        self.buffer.clear()
+        self.original.cleanup()
+
+def apply_gain(data: bytes, gain: float) -> bytes:
+    """Multiplie une trame PCM s16le par gain (écrêtée), sans audioop"""
+    if np is not None:
+        pcm = np.frombuffer(data, dtype=np.int16).astype(np.float32)
+        pcm *= gain
+        np.clip(pcm, -32768, 32767, out=pcm)
+        return pcm.astype(np.int16).tobytes()
+    samples = array('h', data)
+    return array('h', (max(-32768, min(32767, int(v * gain))) for v in samples)).tobytes()
+
+class GainStage(discord.AudioSource):
+    """Volume par guild appliqué trame par trame : un changement est audible à la trame suivante"""
+    def __init__(self, original: discord.AudioSource, owner):
+        self.original = original
+        self.owner = owner  # objet portant .volume (le MusicBot de la guild)
+
+    def read(self) -> bytes:
+        data = self.original.read()
+        gain = self.owner.volume
+        if not data or gain == 1.0:
+            return data
+        return apply_gain(data, gain)
+
+    def is_opus(self) -> bool:
+        return False
+
+    @property
+    def _current_error(self):
+        return getattr(self.original, '_current_error', None)
+
+    def cleanup(self):
+        self.original.cleanup()
+
+def can_passthrough(acodec: Optional[str], owner=None) -> bool:
+    """Le flux est déjà en Opus : on peut le remuxer tel quel au lieu de décoder/réencoder"""
+    if not OPUS_PASSTHROUGH or not acodec:
+        return False
+    # impossible d'appliquer un volume sur des paquets Opus : passthrough seulement à 100 %
+    if owner is not None and owner.volume != 1.0:
+        return False
+    return acodec.split('.')[0].lower() == 'opus'
+
+# Cache disque des morceaux distants : copie écrite pendant la première lecture, LRU sous un budget
+TRACK_CACHE_MB = int(os.getenv("TRACK_CACHE_MB", "0"))  # 0 = désactivé
+TRACK_CACHE_DIR = os.getenv("TRACK_CACHE_DIR", "track_cache")
+TEE_FLUSH_TIMEOUT = 10  # secondes laissées à FFmpeg pour finaliser la copie en fin de flux
+
+class TrackTee:
+    """Copie en cours d'écriture : validée seulement si le flux a été lu jusqu'au bout"""
+    def __init__(self, cache: 'TrackCache', digest: str, ext: str, duration: float):
+        self.cache = cache
+        self.digest = digest
+        self.ext = ext
+        self.duration = duration
+        self.tmp = os.path.join(cache.directory, f"{digest}.{ext}.{os.getpid()}.part")
+        self.frames = 0
+        self.eof = False
+        self.done = False
+
+    def output_args(self) -> List[str]:
+        """Sortie FFmpeg supplémentaire : l'audio d'origine recopié tel quel (sans réencodage)"""
+        fmt = 'ogg' if self.ext == 'opus' else 'matroska'
+        return ['-map', '0:a:0', '-vn', '-c:a', 'copy', '-f', fmt, self.tmp]
+
+    def finish(self, returncode: Optional[int]):
+        if self.done:
+            return
+        self.done = True
+        played = self.frames * FRAME_SECONDS
+        complete = (self.eof and returncode == 0 and self.frames > 0
+                    and abs(played - self.duration) <= max(3.0, self.duration * 0.02))
+        self.cache.finish(self, complete)
+
+class _TeeMixin:
+    """Source FFmpeg qui écrit aussi le flux dans le cache ; à combiner avec une source discord.py"""
+    def _spawn(self, source: str, tee: TrackTee, executable: str, args: List[str]):
+        self.tee = tee
+        discord.FFmpegAudio.__init__(self, source, executable=executable, args=args,
+                                     stdin=subprocess.DEVNULL)
+
+    def read(self) -> bytes:
+        data = super().read()
+        if data:
+            self.tee.frames += 1
+        else:
+            self.tee.eof = True
+        return data
+
+    def cleanup(self):
+        proc = getattr(self, '_process', None)
+        if self.tee.eof and isinstance(proc, subprocess.Popen):
+            # fin naturelle : laisser FFmpeg écrire la fin du conteneur avant de conclure
+            with contextlib.suppress(subprocess.TimeoutExpired):
+                proc.wait(timeout=TEE_FLUSH_TIMEOUT)
+        super().cleanup()
+        self.tee.finish(proc.returncode if isinstance(proc, subprocess.Popen) else None)
+
+class TeeingPCMAudio(_TeeMixin, discord.FFmpegPCMAudio):
+    def __init__(self, source: str, tee: TrackTee, *, executable: str = 'ffmpeg',
+                 before_options: Optional[str] = None, options: Optional[str] = None):
+        args = [*shlex.split(before_options or ''), '-i', source, *tee.output_args(),
+                '-map', '0:a:0', '-f', 's16le', '-ar', '48000', '-ac', '2', '-loglevel', 'warning',
+                *shlex.split(options or ''), 'pipe:1']
+        self._spawn(source, tee, executable, args)
+
+class TeeingOpusAudio(_TeeMixin, discord.FFmpegOpusAudio):
+    def __init__(self, source: str, tee: TrackTee, *, executable: str = 'ffmpeg',
+                 before_options: Optional[str] = None, options: Optional[str] = None):
+        args = [*shlex.split(before_options or ''), '-i', source, *tee.output_args(),
+                '-map', '0:a:0', '-map_metadata', '-1', '-f', 'opus', '-c:a', 'copy', '-loglevel', 'warning',
+                *shlex.split(options or ''), 'pipe:1']
+        self._spawn(source, tee, executable, args)
+        self._packet_iter = OggStream(self._stdout).iter_packets()
+
+class TrackCache:
+    """Copies locales des morceaux distants, partagées entre guilds (clé : lien canonique)
+
+    Appelé depuis l'event loop (lookup) comme depuis les threads audio (begin/finish) : tout
+    l'état passe par un verrou. Seuls les fichiers renommés depuis leur .part sont servis.
+    """
+    def __init__(self, directory: str = TRACK_CACHE_DIR, max_bytes: int = TRACK_CACHE_MB * 1024 * 1024):
+        self.directory = directory
+        self._root = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict = OrderedDict()  # digest -> (chemin, taille), du plus ancien au plus récent
+        self._writing: Set[str] = set()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.aborted = 0
+        self.evicted = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def digest_for(page_url: str) -> str:
+        return hashlib.sha1(canonical_url(page_url).encode()).hexdigest()
+
+    def contains(self, path: Optional[str]) -> bool:
+        return bool(path) and os.path.abspath(path).startswith(self._root + os.sep)
+
+    def load(self):
+        """Relit le répertoire (bloquant) : ordre LRU d'après les mtime, .part orphelins supprimés"""
+        if not self.enabled:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        found = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(".part"):
+                    with contextlib.suppress(OSError):
+                        os.remove(entry.path)  # écriture interrompue par un arrêt du bot
+                elif entry.is_file():
+                    st = entry.stat()
+                    found.append((st.st_mtime, entry.name.split(".", 1)[0], entry.path, st.st_size))
+        found.sort()
+        with self._lock:
+            for _, digest, path, size in found:
+                self._entries[digest] = (path, size)
+                self._bytes += size
+            victims = self._evict_locked()
+        self._remove(victims)
+
+    def lookup(self, page_url: Optional[str]) -> Optional[Tuple[str, Optional[str]]]:
+        """(chemin local, acodec) si le morceau est en cache"""
+        if not self.enabled or not page_url:
+            return None
+        digest = self.digest_for(page_url)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(digest)
+            self.hits += 1
+        path = entry[0]
+        with contextlib.suppress(OSError):
+            os.utime(path)  # l'ordre LRU survit au redémarrage
+        return path, ("opus" if path.endswith(".opus") else None)
+
+    def begin(self, page_url: Optional[str], acodec: Optional[str],
+              duration: Optional[float]) -> Optional[TrackTee]:
+        """Réserve l'écriture d'un morceau ; None s'il est déjà en cache ou en cours d'écriture"""
+        if not self.enabled or not page_url or not duration:
+            return None  # durée inconnue (direct, radio) : jamais mis en cache
+        digest = self.digest_for(page_url)
+        with self._lock:
+            if digest in self._entries or digest in self._writing:
+                return None
+            self._writing.add(digest)
+        os.makedirs(self.directory, exist_ok=True)
+        return TrackTee(self, digest, "opus" if acodec == "opus" else "mka", duration)
+
+    def finish(self, tee: TrackTee, complete: bool):
+        final = os.path.join(self.directory, f"{tee.digest}.{tee.ext}")
+        size = 0
+        if complete:
+            try:
+                size = os.path.getsize(tee.tmp)
+                complete = 0 < size <= self.max_bytes
+                if complete:
+                    os.replace(tee.tmp, final)
+            except OSError:
+                complete = False
+        if not complete:
+            with contextlib.suppress(OSError):
+                os.remove(tee.tmp)
+        with self._lock:
+            self._writing.discard(tee.digest)
+            if complete:
+                self._entries[tee.digest] = (final, size)
+                self._bytes += size
+                self.stored += 1
+            else:
+                self.aborted += 1
+            victims = self._evict_locked()
+        self._remove(victims)
+
+    def _evict_locked(self) -> List[str]:
+        victims = []
+        while self._bytes > self.max_bytes and self._entries:
+            _, (path, size) = self._entries.popitem(last=False)
+            self._bytes -= size
+            self.evicted += 1
+            victims.append(path)
+        return victims
+
+    @staticmethod
+    def _remove(paths: List[str]):
+        for path in paths:
+            with contextlib.suppress(OSError):
+                os.remove(path)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes,
+                    "writing": len(self._writing), "hits": self.hits, "misses": self.misses,
+                    "stored": self.stored, "aborted": self.aborted, "evicted": self.evicted}
+
+track_cache = TrackCache()
+
+# Tous les FFmpeg du bot passent par ce superviseur : plafonds, ramassage, CPU/RSS, flux bloqués
+FFMPEG_MAX_PROCS = int(os.getenv("FFMPEG_MAX_PROCS", "64"))          # pour tout le process
+FFMPEG_MAX_PER_GUILD = int(os.getenv("FFMPEG_MAX_PER_GUILD", "3"))   # courant + suivant amorcé + rechange volume
+FFMPEG_SLOT_TIMEOUT = 10.0    # attente max d'une place libre avant d'abandonner
+FFMPEG_SAMPLE_INTERVAL = 2.0
+FFMPEG_MAX_CPU = float(os.getenv("FFMPEG_MAX_CPU", "0.9"))          # fraction d'un cœur, soutenue (lecture)
+FFMPEG_MAX_RSS_MB = int(os.getenv("FFMPEG_MAX_RSS_MB", "256"))
+FFMPEG_STALL_TIMEOUT = float(os.getenv("FFMPEG_STALL_TIMEOUT", "20"))  # read() bloqué : flux mort
+FFMPEG_ORPHAN_TIMEOUT = 1800.0  # plus personne ne lit la source (fuite, hors pause) : on libère la place
+FFMPEG_HOT_SAMPLES = 3  # échantillons consécutifs au-dessus de FFMPEG_MAX_CPU avant de tuer
+_CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+class FFmpegProc:
+    """Un process FFmpeg suivi : guild, mode, ressources et activité de son lecteur"""
+    def __init__(self, guild_id: Optional[int], mode: str):
+        self.guild_id = guild_id
+        self.mode = mode  # pcm | opus | transcode
+        self.proc = None  # subprocess.Popen ou asyncio.subprocess.Process
+        self.started = time.monotonic()
+        self.last_read = self.started
+        self.reading_since: Optional[float] = None  # posé pendant un read() en cours
+        self.cpu = 0.0  # fraction d'un cœur sur le dernier intervalle
+        self.rss = 0
+        self.hot = 0
+        self._ticks: Optional[int] = None
+        self.released = False
+
+    @property
+    def pid(self) -> Optional[int]:
+        return getattr(self.proc, "pid", None)
+
+    def exited(self) -> bool:
+        if isinstance(self.proc, subprocess.Popen):
+            return self.proc.poll() is not None  # poll() ramasse aussi le zombie
+        return self.proc is not None and self.proc.returncode is not None
+
+    def sample(self, interval: float):
+        """CPU et RSS depuis /proc (Linux) ; ailleurs rien n'est mesuré"""
+        try:
+            with open(f"/proc/{self.pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            with open(f"/proc/{self.pid}/statm") as f:
+                self.rss = int(f.read().split()[1]) * _PAGE_SIZE
+        except (OSError, IndexError, ValueError):
+            return
+        ticks = int(fields[11]) + int(fields[12])  # utime + stime
+        if self._ticks is not None:
+            self.cpu = (ticks - self._ticks) / _CLK_TCK / interval
+        self._ticks = ticks
+
+class FFmpegSupervisor:
+    """Places FFmpeg (globales et par guild) et thread de surveillance des process lancés
+
+    reserve() attend une place sur l'event loop, acquire() en bloquant (hors event loop) ; une
+    place est rendue au cleanup de la source, ou par le thread de surveillance quand le process
+    meurt seul. Une place rendue va directement au plus ancien reserve() en attente qui peut
+    la prendre (plafond par guild compris) : pas de course entre attentes réveillées.
+    """
+    def __init__(self, max_procs: int = FFMPEG_MAX_PROCS, max_per_guild: int = FFMPEG_MAX_PER_GUILD):
+        self.max_procs = max_procs
+        self.max_per_guild = max_per_guild
+        self._cond = threading.Condition()
+        self._procs: Set[FFmpegProc] = set()
+        self._per_guild: Counter = Counter()
+        self._waiters: List[tuple] = []  # reserve() en attente : (loop, future, guild, mode, remplacé)
+        self._thread: Optional[threading.Thread] = None
+        self.spawned = 0
+        self.rejected = 0
+        self.reaped = 0  # places rendues par la surveillance (process mort sans cleanup)
+        self.killed: Counter = Counter()  # raison -> nombre
+        self.is_paused = None  # appelé (thread de surveillance) avec une guild : vrai si sa lecture est en pause
+
+    def _has_room(self, guild_id: Optional[int], replacing: Optional[FFmpegProc] = None) -> bool:
+        if len(self._procs) >= self.max_procs:
+            return False
+        if guild_id is None:
+            return True
+        used = self._per_guild[guild_id]
+        if replacing is not None and replacing.guild_id == guild_id and not replacing.released:
+            used -= 1  # process remplacé (changement de volume) : il s'arrête dès que le nouveau joue
+        return used < self.max_per_guild
+
+    def _take(self, guild_id: Optional[int], mode: str) -> FFmpegProc:
+        rec = FFmpegProc(guild_id, mode)
+        self._procs.add(rec)
+        if guild_id is not None:
+            self._per_guild[guild_id] += 1
+        self.spawned += 1
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._watch, name="ffmpeg-supervisor", daemon=True)
+            self._thread.start()
+        return rec
+
+    def acquire(self, guild_id: Optional[int], mode: str, timeout: float = FFMPEG_SLOT_TIMEOUT) -> FFmpegProc:
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._has_room(guild_id), timeout):
+                self.rejected += 1
+                raise RuntimeError("Trop de process FFmpeg en cours, réessaie dans un instant")
+            return self._take(guild_id, mode)
+
+    async def reserve(self, guild_id: Optional[int], mode: str, timeout: float = FFMPEG_SLOT_TIMEOUT,
+                      replacing: Optional[FFmpegProc] = None) -> FFmpegProc:
+        """Comme acquire(), mais l'attente se fait sur l'event loop : aucun thread de l'executor
+        (partagé avec résolutions, hash, chargements) ne reste bloqué faute de place"""
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            if self._has_room(guild_id, replacing):
+                return self._take(guild_id, mode)
+            waiter = loop.create_future()
+            entry = (loop, waiter, guild_id, mode, replacing)
+            self._waiters.append(entry)
+        rec = None
+        try:
+            rec = await asyncio.wait_for(waiter, timeout)
+            return rec
+        except asyncio.TimeoutError:
+            with self._cond:
+                self.rejected += 1
+            raise RuntimeError("Trop de process FFmpeg en cours, réessaie dans un instant") from None
+        finally:
+            if rec is None:  # délai dépassé ou annulé : plus personne n'attend cette place
+                with self._cond:
+                    with contextlib.suppress(ValueError):
+                        self._waiters.remove(entry)
+                if waiter.done() and not waiter.cancelled():
+                    self.release(waiter.result())  # attribuée pendant l'annulation : passe au suivant
+
+    def _grant(self) -> List[tuple]:
+        """Attribue les places libres aux reserve() en attente, dans l'ordre d'arrivée (sous _cond)"""
+        granted = []
+        for entry in list(self._waiters):
+            if len(self._procs) >= self.max_procs:
+                break
+            loop, waiter, guild_id, mode, replacing = entry
+            if self._has_room(guild_id, replacing):
+                self._waiters.remove(entry)
+                granted.append((loop, waiter, self._take(guild_id, mode)))
+        return granted
+
+    def _hand_over(self, waiter: asyncio.Future, rec: FFmpegProc):
+        """Sur la loop du reserve() servi : s'il a abandonné entre-temps, la place passe au suivant"""
+        if waiter.done():
+            self.release(rec)
+        else:
+            waiter.set_result(rec)
+
+    def renew(self, rec: Optional[FFmpegProc], mode: str) -> Optional[FFmpegProc]:
+        """Place pour le process qui remplace celui de rec, rendue juste après : prise sans attendre,
+        le total ne bouge pas et personne en file ne perd son tour (None si rec est déjà rendue)"""
+        with self._cond:
+            if rec is None or rec.released:
+                return None  # process déjà ramassé : la place s'attend comme une autre
+            return self._take(rec.guild_id, mode)
+
+    def attach(self, rec: FFmpegProc, proc):
+        rec.proc = proc
+
+    def release(self, rec: FFmpegProc):
+        with self._cond:
+            if rec.released:
+                return
+            rec.released = True
+            self._procs.discard(rec)
+            if rec.guild_id is not None:
+                self._per_guild[rec.guild_id] -= 1
+                if self._per_guild[rec.guild_id] <= 0:
+                    del self._per_guild[rec.guild_id]
+            granted = self._grant()
+            self._cond.notify_all()  # acquire() bloqués : ce qui reste après les reserve() en file
+        for loop, waiter, granted_rec in granted:  # release() arrive de n'importe quel thread
+            try:
+                loop.call_soon_threadsafe(self._hand_over, waiter, granted_rec)
+            except RuntimeError:  # loop fermée
+                self.release(granted_rec)
+
+    def kill(self, rec: FFmpegProc, reason: str):
+        """SIGKILL (le read() en attente rend b'' : le morceau se termine normalement)"""
+        print(f"FFmpeg {rec.pid} ({rec.mode}, guild {rec.guild_id}) tué : {reason}")
+        self.killed[reason] += 1
+        FFMPEG_FAILURES.inc(mode=rec.mode)
+        with contextlib.suppress(OSError, TypeError):
+            os.kill(rec.pid, getattr(signal, "SIGKILL", signal.SIGTERM))
+
+    def _watch(self):
+        while True:
+            time.sleep(FFMPEG_SAMPLE_INTERVAL)
+            with self._cond:
+                procs = list(self._procs)
+            now = time.monotonic()
+            for rec in procs:
+                if rec.proc is None:
+                    continue  # en cours de lancement
+                if rec.exited():
+                    self.reaped += 1
+                    self.release(rec)
+                    continue
+                rec.sample(FFMPEG_SAMPLE_INTERVAL)
+                if rec.guild_id is not None and self.is_paused is not None and self.is_paused(rec.guild_id):
+                    rec.last_read = now  # en pause, personne ne lit : le délai d'orphelin repart à la reprise
+                reason = self._verdict(rec, now)
+                if reason:
+                    self.kill(rec, reason)
+
+    @staticmethod
+    def _verdict(rec: FFmpegProc, now: float) -> Optional[str]:
+        if rec.rss > FFMPEG_MAX_RSS_MB * 2**20:
+            return "rss"
+        if rec.mode == "transcode":
+            return None  # un transcodage a le droit d'occuper un cœur
+        rec.hot = rec.hot + 1 if rec.cpu > FFMPEG_MAX_CPU else 0
+        if rec.hot >= FFMPEG_HOT_SAMPLES:
+            return "cpu"
+        reading = rec.reading_since
+        if reading is not None and now - reading > FFMPEG_STALL_TIMEOUT:
+            return "stall"
+        if reading is None and now - rec.last_read > FFMPEG_ORPHAN_TIMEOUT:
+            return "orphan"
+        return None
+
+    def processes(self) -> List[FFmpegProc]:
+        with self._cond:
+            return list(self._procs)
+
+    def stats(self) -> dict:
+        procs = self.processes()
+        return {"running": len(procs), "max": self.max_procs, "guilds": len(self._per_guild),
+                "cpu": sum(p.cpu for p in procs), "rss": sum(p.rss for p in procs),
+                "spawned": self.spawned, "rejected": self.rejected, "reaped": self.reaped,
+                "killed": dict(self.killed)}
+
+ffmpeg_supervisor = FFmpegSupervisor()
+
+class SupervisedSource(discord.AudioSource):
+    """Source FFmpeg dont le superviseur voit les lectures ; rend sa place au cleanup"""
+    def __init__(self, original: discord.AudioSource, rec: FFmpegProc):
+        self.original = original
+        self.rec = rec
+
+    def read(self) -> bytes:
+        rec = self.rec
+        rec.reading_since = time.monotonic()
+        data = self.original.read()
+        rec.last_read = time.monotonic()
+        rec.reading_since = None
+        return data
+
+    def is_opus(self) -> bool:
+        return self.original.is_opus()
+
+    @property
+    def _current_error(self):
+        return getattr(self.original, '_current_error', None)
+
+    def cleanup(self):
+        try:
+            self.original.cleanup()  # kill + wait : le process est ramassé ici
+        finally:
+            ffmpeg_supervisor.release(self.rec)
+
+def supervised_rec(source) -> Optional[FFmpegProc]:
+    """Place FFmpeg d'une source, à travers ses enveloppes (chaîne, gain, amorçage)"""
+    while source is not None and not isinstance(source, SupervisedSource):
+        source = getattr(source, "source", None) or getattr(source, "original", None)
+    return source.rec if source is not None else None
+
+def reads_local_ogg(stream_url: str, acodec: Optional[str], owner=None, start: float = 0.0) -> bool:
+    """Fichier Ogg Opus local lu sans process (transcodé ou copie du cache de morceaux)"""
+    local_ogg = opus_cache.contains(stream_url) or (track_cache.contains(stream_url)
+                                                   and stream_url.endswith(".opus"))
+    return local_ogg and not start and can_passthrough(acodec, owner)
+
+def open_primed_source(stream_url: str, acodec: Optional[str] = None, owner=None,
+                       start: float = 0.0, item: Optional[dict] = None,
+                       slot: Optional[FFmpegProc] = None) -> discord.AudioSource:
+    """Lance FFmpeg et lit ses premières trames (bloquant : à appeler hors de l'event loop)
+
+    owner : MusicBot dont le volume s'applique (étage de gain PCM) ; start : position en secondes ;
+    item : morceau distant à recopier dans le cache disque pendant la lecture ; slot : place
+    FFmpeg déjà réservée (sinon elle est attendue ici, en bloquant).
+    """
+    kwargs = dict(ffmpeg_options)
+    if FFMPEG_PATH:
+        kwargs['executable'] = FFMPEG_PATH
+    if start:
+        kwargs['before_options'] = f"{kwargs['before_options']} -ss {start:.2f}"
+    if reads_local_ogg(stream_url, acodec, owner, start):
+        # fichier Ogg Opus local : paquets lus directement sur le disque, aucun process
+        return PrimedSource(OggOpusFileSource(stream_url)).prime(PRIME_FRAMES)
+    page_url = item.get("page_url") if item is not None and not start else None
+    guild_id = getattr(owner, "guild_id", None)
+    if can_passthrough(acodec, owner):
+        # paquets Opus d'origine remuxés en Ogg : ni décodage FFmpeg ni encodage discord.py
+        tee = track_cache.begin(page_url, acodec, item and item.get("duration"))
+        if tee is not None:
+            source = _spawn_ffmpeg("opus", guild_id, TeeingOpusAudio, stream_url, tee, slot=slot, **kwargs)
+        else:
+            source = _spawn_ffmpeg("opus", guild_id, discord.FFmpegOpusAudio, stream_url, codec='copy',
+                                   slot=slot, **kwargs)
+        primed = PrimedSource(source).prime(PRIME_FRAMES)
+        if primed.buffer:
+            return primed
+        FFMPEG_FAILURES.inc(mode="opus")
+        print(f"Opus passthrough impossible ({acodec}), retour au PCM : {primed._current_error}")
+        # la place passe au process PCM avant d'être rendue : ni attente ici, ni passe-droit sur la file
+        slot = ffmpeg_supervisor.renew(supervised_rec(primed), "pcm")
+        primed.cleanup()
+    tee = track_cache.begin(page_url, acodec, item and item.get("duration"))
+    if tee is not None:
+        source = _spawn_ffmpeg("pcm", guild_id, TeeingPCMAudio, stream_url, tee, slot=slot, **kwargs)
+    else:
+        source = _spawn_ffmpeg("pcm", guild_id, discord.FFmpegPCMAudio, stream_url, slot=slot, **kwargs)
+    primed = PrimedSource(source).prime(PRIME_FRAMES)
+    if not primed.buffer:
+        FFMPEG_FAILURES.inc(mode="pcm")
+    return GainStage(primed, owner) if owner is not None else primed
+
+async def open_in_executor(opener, *args) -> Optional[discord.AudioSource]:
+    """Ouvre une source dans l'executor (FFmpeg lancé et amorcé hors de l'event loop)
+
+    Si l'appelant est annulé entre-temps (!stop), l'ouverture continue dans son thread :
+    la source est alors fermée dès qu'elle arrive, sinon son FFmpeg garderait sa place.
+    """
+    loop = asyncio.get_running_loop()
+    fut = loop.run_in_executor(None, opener, *args)
+    try:
+        return await asyncio.shield(fut)
+    except asyncio.CancelledError:
+        fut.add_done_callback(_discard_opened)
+        raise
+
+async def open_primed_source_async(stream_url: str, acodec: Optional[str] = None, owner=None,
+                                   start: float = 0.0, item: Optional[dict] = None,
+                                   replacing: Optional[FFmpegProc] = None) -> discord.AudioSource:
+    """open_primed_source dans l'executor, la place FFmpeg étant d'abord attendue sur l'event loop
+
+    replacing : place du process que la nouvelle source remplace (ne compte pas dans la limite
+    par guild).
+    """
+    slot = None
+    if not reads_local_ogg(stream_url, acodec, owner, start):
+        slot = await ffmpeg_supervisor.reserve(getattr(owner, "guild_id", None), "pcm", replacing=replacing)
+    return await open_in_executor(_open_reserved, slot, stream_url, acodec, owner, start, item)
+
+def _open_reserved(slot: Optional[FFmpegProc], *args) -> discord.AudioSource:
+    try:
+        return open_primed_source(*args, slot=slot)
+    finally:
+        if slot is not None and slot.proc is None:
+            ffmpeg_supervisor.release(slot)  # aucun process lancé avec cette place (fichier local, erreur)
+
+def _discard_opened(fut: asyncio.Future):
+    if fut.cancelled() or fut.exception() is not None or fut.result() is None:
+        return
+    discard_source(fut.result())  # la fermeture attend la fin du process : pas sur l'event loop
+
+def _spawn_ffmpeg(mode: str, guild_id: Optional[int], cls, stream_url: str, *args,
+                  slot: Optional[FFmpegProc] = None, **kwargs) -> discord.AudioSource:
+    """Lance une source FFmpeg discord.py dans une place du superviseur (bloquant : hors event loop)
+
+    slot : place réservée d'avance par reserve() ; sans elle, la place est attendue ici.
+    """
+    rec = slot
+    try:
+        if rec is None:
+            rec = ffmpeg_supervisor.acquire(guild_id, mode)
+        rec.mode = mode
+        FFMPEG_SPAWNS.inc(mode=mode)
+        source = cls(stream_url, *args, **kwargs)
+    except Exception:
+        if rec is not None:
+            FFMPEG_FAILURES.inc(mode=mode)
+            ffmpeg_supervisor.release(rec)
+        if args and isinstance(args[0], TrackTee):
+            args[0].finish(None)  # FFmpeg n'a pas démarré : libérer la réservation
+        raise
+    ffmpeg_supervisor.attach(rec, source._process)
+    return SupervisedSource(source, rec)
+
+def ensure_encoder(voice_client):
+    """Crée l'encodeur Opus du VoiceClient s'il n'existe pas encore
+
+    play() ne le crée que si la première source est en PCM : une source PCM enchaînée
+    derrière une source Opus (passthrough, fichier .opus) le trouverait absent.
+    """
+    if voice_client is not None and getattr(voice_client, "encoder", None) is discord.utils.MISSING:
+        voice_client.encoder = discord.opus.Encoder()
+
+def discard_source(source: discord.AudioSource):
+    """Ferme une source dans un thread : la fin du process FFmpeg peut se faire attendre"""
+    threading.Thread(target=source.cleanup, daemon=True).start()
+
+class TrackChain(discord.AudioSource):
+    """Source donnée au VoiceClient : passe à la source suivante à la trame près, dans le thread audio
+
+    notify est appelé (depuis le thread audio) quand le morceau change et quand on atteint
+    le moment d'amorcer le suivant : c'est ce qui réveille player_loop, sans aucun polling.
+    """
+    def __init__(self, source: discord.AudioSource, item: dict, notify=None, owner=None):
+        self.source = source
+        self.item = item
+        self.notify = notify
+        self.owner = owner  # objet portant .volume : un flux Opus n'est enchaîné qu'à volume 1.0
+        self.refused = None  # (source, item) amorcé en Opus mais refusé au passage (volume changé)
+        self.finished = False  # posé par le callback after du VoiceClient
+        self.frames = 0  # trames lues du morceau courant
+        self._lead_frame = self._lead_frame_for(item)
+        self._next = None  # (source, item) amorcé
+        self._replacement = None  # (source, trame de départ) pour remplacer le morceau courant
+        self._skip = False
+        self._ended = False
+        self._current_error = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _lead_frame_for(item: dict) -> Optional[int]:
+        duration = item.get("duration")
+        if not duration:
+            return None
+        return max(0, int((duration - GAPLESS_LEAD) / FRAME_SECONDS))
+
+    def _notify(self):
+        if self.notify is not None:
+            self.notify()
+
+    def position(self) -> float:
+        return self.frames * FRAME_SECONDS
+
+    def wants_next(self) -> bool:
+        """Vrai quand il est temps d'amorcer le morceau suivant"""
+        duration = self.item.get("duration")
+        if self._next is not None or self._ended or not duration:
+            return False
+        return duration - self.position() <= GAPLESS_LEAD
+
+    def queue_next(self, source: discord.AudioSource, item: dict) -> bool:
+        with self._lock:
+            if self._ended:
+                return False
+            self._next = (source, item)
+            return True
+
+    def replace_current(self, source: discord.AudioSource, start_frame: int) -> bool:
+        """Remplace la source du morceau courant (même morceau, ouverte à start_frame)"""
+        with self._lock:
+            if self._ended:
+                return False
+            self._replacement = (source, start_frame)
+            return True
+
+    def drop_next(self, cleanup: bool = True) -> Optional[dict]:
+        """Abandonne le morceau amorcé (fermé dans un thread : appelé depuis l'event loop), renvoie son item"""
+        with self._lock:
+            nxt, self._next = self._next, None
+        if nxt is None:
+            return None
+        if cleanup:
+            discard_source(nxt[0])
+        return nxt[1]
+
+    def skip(self) -> bool:
+        """Bascule immédiate sur le morceau amorcé (False s'il n'y en a pas)"""
+        with self._lock:
+            if self._next is None:
+                return False
+            self._skip = True
+            return True
+
+    def read(self) -> bytes:
+        if self._replacement is not None:
+            with self._lock:
+                (source, start_frame), self._replacement = self._replacement, None
+            # la nouvelle source a démarré à start_frame : on saute ce qui a joué entre-temps
+            for _ in range(self.frames - start_frame):
+                source.read()
+            old, self.source = self.source, source
+            discard_source(old)
+        while True:
+            data = b'' if self._skip else self.source.read()
+            if data:
+                self.frames += 1
+                if self.frames == self._lead_frame:
+                    self._notify()
+                return data
+            with self._lock:
+                nxt, self._next, self._skip = self._next, None, False
+                if nxt is not None and not self._accepts(nxt[0]):
+                    self.refused, nxt = nxt, None  # player_loop le remet en file et le rouvre en PCM
+                if nxt is None:
+                    self._ended = True
+                    self._current_error = getattr(self.source, '_current_error', None)
+                    return b''
+            old = self.source
+            self.source, self.item = nxt
+            self.frames = 0
+            self._lead_frame = self._lead_frame_for(self.item)
+            # tuer l'ancien FFmpeg peut attendre le process : pas dans le thread audio
+            discard_source(old)
+            self._notify()
+
+    def _accepts(self, source: discord.AudioSource) -> bool:
+        """Le passthrough Opus ne laisse pas appliquer de gain : refusé si le volume a changé depuis l'amorçage"""
+        return not source.is_opus() or self.owner is None or self.owner.volume == 1.0
+
+    def is_opus(self) -> bool:
+        return self.source.is_opus()
+
+    def cleanup(self):
+        with self._lock:
+            self._ended = True
+            nxt, self._next = self._next, None
+            replacement, self._replacement = self._replacement, None
+        self.source.cleanup()
+        for pending in (nxt, replacement):
+            if pending is not None:
+                pending[0].cleanup()
+
+# Préchargement : pendant qu'un morceau joue, on résout les N suivants de la queue
+PREFETCH_WINDOW = int(os.getenv("PREFETCH_WINDOW", "2"))
+PREFETCH_MAX = 10
+
+# Files d'attente persistées : journal en ajout seul (une ligne JSON = état d'une guild), compacté
+# vide = pas de persistance ; avec SHARD_IDS, un journal par bloc de shards (même nom que cluster.py)
+QUEUE_STORE = os.getenv("QUEUE_STORE", f"botmusic_queues.s{min(SHARD_IDS)}-{max(SHARD_IDS)}.jsonl"
+                        if SHARD_IDS else "botmusic_queues.jsonl")
+QUEUE_FLUSH_INTERVAL = 2.0      # les modifications sont écrites par lot, au plus tard après ce délai
+QUEUE_POSITION_INTERVAL = 15.0  # position des guilds en lecture notée à ce rythme
+QUEUE_STORE_MAX_BYTES = 8 * 1024 * 1024  # au-delà, réécriture avec le dernier état de chaque guild
+RESTORE_CONCURRENCY = 4  # reconnexions vocales simultanées à la reprise
+
+def _persistable(item: dict) -> dict:
+    """Item de queue sans ce qui expire : le lien d'origine suffit à le résoudre de nouveau"""
+    entry = {"title": item["title"], "duration": item.get("duration")}
+    if item.get("page_url"):
+        entry["page_url"] = item["page_url"]
+    else:
+        entry["url"] = item.get("url")  # fichier local ou flux brut
+        entry["acodec"] = item.get("acodec")
+    return entry
+
+def _restored(entry: dict) -> dict:
+    return make_track(entry.get("title") or "Titre inconnu", entry.get("url"), page_url=entry.get("page_url"),
+                      duration=entry.get("duration"), acodec=entry.get("acodec"))
+
+class QueueStore:
+    """Journal des files par guild : instantanés groupés, écrits par un thread dédié
+
+    Seule la dernière ligne complète de chaque guild compte ; une guild sans morceau écrit une
+    ligne vide qui l'efface. La position de lecture est notée à part, dans de petites lignes
+    {g, at, position} qui ne réécrivent pas la file. Au démarrage le journal est relu puis
+    compacté, et chaque guild n'est reconstruite qu'à son premier usage (ou relancée si elle jouait).
+    """
+    def __init__(self, path: str = QUEUE_STORE):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="queue-store")
+        self._dirty: Dict[int, "MusicBot"] = {}
+        self._positions: Dict[int, "MusicBot"] = {}  # guilds dont seule la position est à noter
+        self._latest: Dict[int, dict] = {}  # guild -> dernier état (thread du store uniquement)
+        self._size = 0
+        self._pending: Dict[int, dict] = {}  # instantanés relus, pas encore repris
+        self.task: Optional[asyncio.Task] = None
+        self.closed = False
+        self.written = 0
+
+    def mark(self, music_bot: "MusicBot"):
+        if self.path and not self.closed and music_bot.guild_id is not None:
+            self._dirty[music_bot.guild_id] = music_bot
+
+    def mark_position(self, music_bot: "MusicBot"):
+        if self.path and not self.closed and music_bot.guild_id is not None:
+            self._positions[music_bot.guild_id] = music_bot
+
+    def take(self, guild_id: int) -> Optional[dict]:
+        return self._pending.pop(guild_id, None)
+
+    def pending_playing(self) -> List[dict]:
+        return [snap for snap in self._pending.values() if snap.get("state") == "playing"]
+
+    async def load(self) -> int:
+        if not self.path:
+            return 0
+        loop = asyncio.get_running_loop()
+        self._pending = await loop.run_in_executor(self._executor, self._read)
+        return len(self._pending)
+
+    def _read(self) -> Dict[int, dict]:
+        snaps = {}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        snap = json.loads(line)
+                        gid = snap["g"]
+                        if "queue" in snap:
+                            snaps[gid] = snap
+                        elif gid in snaps:
+                            snaps[gid]["position"] = snap.get("position") or 0.0
+                    except (KeyError, TypeError, ValueError):
+                        continue  # ligne tronquée par un arrêt brutal ou illisible : les autres guilds restent
+        except FileNotFoundError:
+            return {}
+        live = {g: snap for g, snap in snaps.items() if snap.get("current") or snap.get("queue")}
+        self._latest = {g: dict(snap) for g, snap in live.items()}
+        self._compact()
+        return live
+
+    def start(self):
+        if self.path and (self.task is None or self.task.done()):
+            self.task = asyncio.create_task(self.flush_forever())
+
+    async def flush_forever(self):
+        last_positions = time.monotonic()
+        while True:
+            await asyncio.sleep(QUEUE_FLUSH_INTERVAL)
+            if time.monotonic() - last_positions >= QUEUE_POSITION_INTERVAL:
+                last_positions = time.monotonic()
+                for music_bot in music_manager.bots.values():
+                    if music_bot.state == "playing":
+                        self.mark_position(music_bot)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Queue store error: {e}")
+
+    async def flush(self):
+        if not self._dirty and not self._positions:
+            return
+        dirty, self._dirty = self._dirty, {}
+        positions, self._positions = self._positions, {}
+        # instantanés pris sur la loop (état cohérent, items non copiés), mis en forme par le thread du store
+        records = [music_bot.snapshot() for music_bot in dirty.values()]
+        records += [rec for gid, music_bot in positions.items()
+                    if gid not in dirty and (rec := music_bot.position_snapshot()) is not None]
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._append, records)
+
+    @staticmethod
+    def _encode(rec: dict) -> dict:
+        """Instantané de MusicBot.snapshot() → ligne du journal (thread du store)"""
+        if "queue" in rec:
+            current = rec["current"]
+            rec["current"] = _persistable(current) if current is not None else None
+            rec["queue"] = [_persistable(item) for item in rec["queue"]]
+        return rec
+
+    def _append(self, records: List[dict]):
+        records = [self._encode(rec) for rec in records]
+        data = "".join(json.dumps(rec, ensure_ascii=False) + "\n" for rec in records)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(data)
+        self._size += len(data.encode("utf-8"))
+        self.written += len(records)
+        for rec in records:
+            gid = rec["g"]
+            if "queue" not in rec:  # position seule
+                if gid in self._latest:
+                    self._latest[gid]["position"] = rec["position"]
+            elif rec["current"] or rec["queue"]:
+                self._latest[gid] = rec
+            else:
+                self._latest.pop(gid, None)  # guild vide : rien à garder à la compaction
+        if self._size > QUEUE_STORE_MAX_BYTES:
+            self._compact()
+
+    def _compact(self):
+        """Réécrit le journal avec une ligne par guild encore en cours (remplacement atomique)"""
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write("".join(json.dumps(snap, ensure_ascii=False) + "\n" for snap in self._latest.values()))
+        os.replace(tmp, self.path)
+        self._size = os.path.getsize(self.path)
+
+queue_store = QueueStore()
+
+# Messages sortants : regroupés par salon et espacés selon la limite Discord, au lieu d'un envoi par événement
+MESSAGE_DEBOUNCE = float(os.getenv("MESSAGE_DEBOUNCE", "0.5"))  # attente avant envoi, pour regrouper une rafale
+CHANNEL_BURST = 5         # appels API par salon sur CHANNEL_WINDOW (limite Discord : 5 messages / 5 s)
+CHANNEL_WINDOW = 5.0
+SLOW_NOTICE_DELAY = 1.5   # « Récupération du lien... » seulement si la résolution dépasse ce délai
+MESSAGE_LIMIT = 2000
+
+MESSAGES_SENT = metrics.register(CounterMetric(
+    "botmusic_messages_total", "Appels API de messages, par type (send, edit)"))
+MESSAGES_COALESCED = metrics.register(CounterMetric(
+    "botmusic_messages_coalesced_total", "Messages évités : lignes regroupées ou panneau remplacé avant envoi"))
+
+class ChannelOutbox:
+    """File d'envoi d'un salon : une task vide les lignes en attente et met à jour le panneau
+
+    Le panneau « ▶️ Lecture » est un seul message, modifié à chaque morceau tant qu'il est
+    le dernier du salon (sinon un nouveau est posté, l'ancien ne serait plus visible).
+    """
+    def __init__(self, channel):
+        self.channel = channel
+        self.lines = deque()
+        self.panel_text: Optional[str] = None  # prochain contenu du panneau, pas encore affiché
+        self.panel_message: Optional[discord.Message] = None
+        self.task: Optional[asyncio.Task] = None
+        self._calls = deque()  # instants des derniers appels API (fenêtre glissante)
+        self._hurry = asyncio.Event()  # une réponse urgente écourte l'attente de la rafale
+
+    def wake(self, immediate: bool = False):
+        if immediate:
+            self._hurry.set()
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._drain())
+
+    async def _drain(self):
+        with contextlib.suppress(asyncio.TimeoutError):
+            # le reste de la rafale arrive pendant ce temps
+            await asyncio.wait_for(self._hurry.wait(), MESSAGE_DEBOUNCE)
+        while self.lines or self.panel_text is not None:
+            self._hurry.clear()
+            await self._slot()  # en attendant la limite du salon, d'autres lignes peuvent s'ajouter
+            try:
+                if self.lines:
+                    await self._send_lines()
+                else:
+                    text, self.panel_text = self.panel_text, None
+                    await self._show_panel(text)
+            except Exception as e:  # salon supprimé, droits retirés... le message est perdu
+                print(f"Outbox error ({getattr(self.channel, 'id', '?')}): {e}")
+
+    async def _slot(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            while self._calls and now - self._calls[0] >= CHANNEL_WINDOW:
+                self._calls.popleft()
+            if len(self._calls) < CHANNEL_BURST:
+                self._calls.append(now)
+                return
+            await asyncio.sleep(CHANNEL_WINDOW - (now - self._calls[0]))
+
+    async def _send_lines(self):
+        batch, size = [], 0
+        while self.lines:
+            line = self.lines[0][:MESSAGE_LIMIT]
+            if batch and size + len(line) + 1 > MESSAGE_LIMIT:
+                break
+            batch.append(line)
+            size += len(line) + 1
+            self.lines.popleft()
+        await self.channel.send("\n".join(batch))
+        MESSAGES_SENT.inc(kind="send")
+        if len(batch) > 1:
+            MESSAGES_COALESCED.inc(len(batch) - 1)
+
+    async def _show_panel(self, text: str):
+        message = self.panel_message
+        if message is not None and getattr(self.channel, "last_message_id", None) == message.id:
+            try:
+                await message.edit(content=text)
+                MESSAGES_SENT.inc(kind="edit")
+                return
+            except discord.NotFound:
+                pass  # panneau supprimé entre-temps : on en poste un nouveau
+        self.panel_message = await self.channel.send(text)
+        MESSAGES_SENT.inc(kind="send")
+
+class Outbox:
+    """Point d'entrée des messages du salon (lecteur et réponses aux commandes, dans l'ordre) ;
+    cible = contexte de commande ou salon textuel"""
+    def __init__(self):
+        self._channels: Dict[int, ChannelOutbox] = {}
+
+    def _box(self, target) -> ChannelOutbox:
+        channel = getattr(target, "channel", target)
+        box = self._channels.get(channel.id)
+        if box is None:
+            box = self._channels[channel.id] = ChannelOutbox(channel)
+        return box
+
+    def say(self, target, text: str, immediate: bool = False):
+        """Ajoute une ligne, envoyée avec celles qui arrivent dans la même rafale
+
+        immediate : sans attendre la fin de la rafale (réponse avant une opération longue) ;
+        la limite d'appels du salon s'applique quand même.
+        """
+        box = self._box(target)
+        box.lines.append(text)
+        box.wake(immediate)
+
+    def panel(self, target, text: str):
+        """Change le contenu du panneau ; seule la dernière valeur en attente est affichée"""
+        box = self._box(target)
+        if box.panel_text is not None:
+            MESSAGES_COALESCED.inc()
+        box.panel_text = text
+        box.wake()
+
+    def later(self, target, text: str, delay: float) -> asyncio.TimerHandle:
+        """Ligne envoyée seulement si on n'annule pas le handle avant delay"""
+        return asyncio.get_running_loop().call_later(delay, self.say, target, text)
+
+    def forget(self, channel_id: Optional[int]):
+        box = self._channels.pop(channel_id, None)
+        if box is not None and box.task is not None:
+            box.task.cancel()
+
+outbox = Outbox()
+
+class MusicBot:
+    def __init__(self, guild_id: Optional[int] = None):
+        self.guild_id = guild_id
+        self.prefetch_window = PREFETCH_WINDOW
+        self.prefetch_task: Optional[asyncio.Task] = None
+        self._refreshing: Dict[int, asyncio.Task] = {}  # {id(item): résolution en cours}
+        self.playing_item: Optional[dict] = None
+        self.gapless = GAPLESS
+        self.volume = 1.0  # gain appliqué par GainStage (0.0 - 1.0)
+        self.chain: Optional[TrackChain] = None
+        self._carry = None  # (source, item) amorcé mais pas encore joué
         self.voice_client: Optional[discord.VoiceClient] = None
         self.current_song: Optional[str] = None
-        self.queue: asyncio.Queue = asyncio.Queue()
+        self.queue = TrackQueue()
+        self.queue.on_change = self.persist
+        self.text_channel_id: Optional[int] = None  # salon des messages du lecteur (reprise après redémarrage)
         self.player_task: Optional[asyncio.Task] = None
-        self.next_event: Optional[asyncio.Event] = None
+        self._wake: Optional[asyncio.Event] = None  # réveille player_loop pendant un morceau
+        self.state = "idle"  # idle | playing | paused
         self.stopped = False  # pour !stop qui vide la queue
+        self.last_active = time.monotonic()  # dernière commande ou dernier changement de morceau
+
+    def touch(self):
+        self.last_active = time.monotonic()
+
+    def persist(self):
+        """Demande un instantané de la file (écrit par lot, hors de l'event loop)"""
+        queue_store.mark(self)
+
+    def snapshot(self) -> dict:
+        """File, morceau courant et position : ligne du QueueStore
+
+        Pris sur la loop, il ne fait que copier les références des items (une copie de liste) ;
+        le thread du store en retire les URL de flux (elles expirent) au moment d'écrire.
+        """
+        upcoming = []
+        if self._carry is not None:
+            upcoming.append(self._carry[1])
+        chain = self.chain
+        pending = chain._next if chain is not None else None
+        if pending is not None:
+            upcoming.append(pending[1])  # déjà sorti de la file pour l'enchaînement sans blanc
+        upcoming += self.queue.peek(0, len(self.queue))
+        vc = self.voice_client
+        return {
+            "g": self.guild_id,
+            "at": round(time.time(), 1),
+            "state": self.state,
+            "voice": vc.channel.id if vc is not None and vc.channel is not None else None,
+            "text": self.text_channel_id,
+            "current": self.playing_item,
+            "position": round(chain.position(), 1) if chain is not None else 0.0,
+            "queue": upcoming,
+        }
+
+    def position_snapshot(self) -> Optional[dict]:
+        """Position seule (ligne courte du QueueStore), tant qu'un morceau joue"""
+        chain = self.chain
+        if chain is None:
+            return None
+        return {"g": self.guild_id, "at": round(time.time(), 1), "position": round(chain.position(), 1)}
+
+    def restore(self, snap: dict):
+        """Recharge un instantané : rien n'est résolu ici, les flux le seront juste avant lecture"""
+        self.text_channel_id = snap.get("text")
+        items = [_restored(entry) for entry in snap.get("queue") or ()]
+        if snap.get("current"):
+            current = _restored(snap["current"])
+            current["resume_at"] = snap.get("position") or 0.0  # reprise là où la lecture s'était arrêtée
+            items.insert(0, current)
+        for item in items:
+            self.queue.append(item)
+
+    def idle_for(self, now: float) -> float:
+        """Secondes d'inactivité (0 tant qu'un morceau joue ou est en pause, ou que la file n'est pas vide)"""
+        if self.state != "idle" or not self.queue.empty():
+            return 0.0
+        if self.voice_client is not None and self.voice_client.is_paused():
+            return 0.0  # une pause n'est pas un abandon : on garde la guild et sa position
+        return now - self.last_active
+
+    async def close(self):
+        """Libère tout ce que tient la guild : lecteur, résolutions en cours, connexion vocale"""
+        self.stop()
+        for task in list(self._refreshing.values()):
+            task.cancel()
+        if self.voice_client is not None:
+            try:
+                await self.voice_client.disconnect(force=True)
+            except Exception as e:
+                print(f"Voice disconnect error ({self.guild_id}): {e}")
+            self.voice_client = None
+        outbox.forget(self.text_channel_id)
 
     async def join_channel(self, ctx):
         """Rejoindre le canal vocal de l'utilisateur"""
         if ctx.author.voice is None:
-            await ctx.send("Tu dois être dans un canal vocal !")
+            outbox.say(ctx, "Tu dois être dans un canal vocal !")
             return False
 
         channel = ctx.author.voice.channel
@@ -59,156 +2512,718 @@ class MusicBot:
         return True
 
     async def ensure_player(self, ctx):
-        """Démarre la task lecteur si pas encore lancée"""
+        """Démarre la task lecteur si pas encore lancée
+
+        ctx : contexte de commande, ou directement un salon textuel (reprise au démarrage).
+        """
+        self.text_channel_id = getattr(ctx, "channel", ctx).id
         if self.player_task is None or self.player_task.done():
             self.stopped = False
             self.player_task = asyncio.create_task(self.player_loop(ctx))
 
     async def enqueue_stream(self, title: str, stream_url: str):
         """Ajoute un flux (déjà résolu) à la queue"""
-        await self.queue.put({"title": title, "url": stream_url})
+        await self.enqueue_track(make_track(title, stream_url))
+
+    async def enqueue_track(self, track: dict):
+        """Ajoute un item (éventuellement pas encore résolu) à la queue"""
+        await self.enqueue_many([track])
+
+    async def enqueue_many(self, tracks: List[dict]) -> int:
+        """Ajoute un lot d'items en une opération : lecteur réveillé et préchargement lancé une fois"""
+        if not tracks:
+            return 0
+        if self.playing_item is None and self.queue.empty():
+            tracks[0]["requested_at"] = time.monotonic()  # quelqu'un attend le premier son
+        self.queue.extend(tracks)
+        if self.playing_item is not None:
+            self.schedule_prefetch()
+            if self._wake is not None:
+                self._wake.set()  # peut-être le moment d'amorcer le premier du lot
+        return len(tracks)
+
+    def pause(self) -> bool:
+        if self.voice_client is None or not self.voice_client.is_playing():
+            return False
+        self.voice_client.pause()
+        self.state = "paused"
+        return True
 
-    async def resolve_url(self, url: str):
-        """Résout un URL (track ou playlist) -> liste d'items (title, url)"""
+    def resume(self) -> bool:
+        if self.voice_client is None or not self.voice_client.is_paused():
+            return False
+        self.voice_client.resume()
+        self.state = "playing"
+        return True
+
+    def skip(self) -> bool:
+        """Morceau suivant déjà amorcé → bascule directe, sinon on coupe et le lecteur enchaîne"""
+        if self.voice_client is None or not self.voice_client.is_playing():
+            return False
+        if self.chain is None or not self.chain.skip():
+            self.voice_client.stop()
+        return True
+
+    def jump(self, index: int) -> dict:
+        """Joue tout de suite l'item index de la file (ceux d'avant sont retirés)"""
+        self.queue.jump(index)
+        item = self.queue.peek(0, 1)[0]
+        if self.chain is not None:
+            self.chain.drop_next()  # un morceau déjà amorcé passerait avant celui demandé
+        if self.voice_client and (self.voice_client.is_playing() or self.voice_client.is_paused()):
+            self.voice_client.stop()
+        return item
+
+    def clear(self) -> int:
+        """Vide la file, y compris le morceau déjà amorcé pour l'enchaînement ; renvoie le nombre retiré"""
+        count = self.queue.clear()
+        if self.chain is not None and self.chain.drop_next() is not None:
+            count += 1
+        if self._carry is not None:
+            discard_source(self._carry[0])
+            self._carry = None
+            count += 1
+        return count
+
+    def stop(self):
+        """Arrête tout : résolutions annulées, file vidée, lecteur arrêté"""
+        self.stopped = True
+        self.cancel_prefetch()
+        resolver.cancel_guild(self.guild_id)
+        self.clear()
+        if self.voice_client and (self.voice_client.is_playing() or self.voice_client.is_paused()):
+            self.voice_client.stop()
+        if self.player_task and not self.player_task.done():
+            self.player_task.cancel()  # il attend peut-être la queue : la prochaine lecture le relancera
+        self.state = "idle"
+
+    async def resolve_url(self, url: str, guild_id: Optional[int] = None):
+        """Résout un URL (track ou playlist) -> liste d'items de queue
+
+        Les entrées de playlist restent plates (page + titre), leur flux est résolu par
+        player_loop juste avant la lecture.
+        """
         results = []
-        # autoriser playlists pour la résolution
-        opts = ydl_opts.copy()
-        opts["noplaylist"] = False
-        with yt_dlp.YoutubeDL(opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            if info is None:
-                return results
-            if "entries" in info and info["entries"]:
-                for entry in info["entries"]:
-                    if not entry:
-                        continue
-                    title = entry.get("title", "Titre inconnu")
-                    stream_url = entry.get("url")
-                    if stream_url:
-                        results.append((title, stream_url))
-            else:
-                title = info.get("title", "Titre inconnu")
-                stream_url = info.get("url")
-                if stream_url:
-                    results.append((title, stream_url))
+        info = await extract_cached(url, guild_id, need_stream=False)
+        if info is None:
+            return results
+        if info.get("entries"):
+            for entry in info["entries"]:
+                if not entry.get("url"):
+                    continue
+                title = entry.get("title") or "Titre inconnu"
+                results.append(make_track(title, page_url=entry["url"], duration=entry.get("duration")))
+        elif info.get("url") or info.get("formats"):
+            # url absente = métadonnées venues du disque, le flux sera rafraîchi à la lecture
+            title = info.get("title") or "Titre inconnu"
+            results.append(make_track(title, info.get("url"), page_url=info.get("webpage_url") or url,
+                                      duration=info.get("duration"), acodec=info.get("acodec")))
         return results
 
+    async def ensure_stream(self, item: dict, horizon: float = 0.0) -> Optional[str]:
+        """URL de flux jouable pour un item, résolue juste à temps (ou rafraîchie si elle va expirer)
+
+        horizon : dans combien de secondes l'item sera joué (préchargement).
+        """
+        if not track_cache.contains(item["url"]):
+            cached = track_cache.lookup(item.get("page_url"))
+            if cached is not None:
+                # déjà joué (par n'importe quelle guild) : copie locale, aucune requête réseau
+                item["url"], item["acodec"] = cached
+                item["expires"] = item["resolved_at"] = None  # copie locale : n'expire pas
+                return item["url"]
+        deadline = stream_deadline(item)
+        fresh = deadline is None or deadline - time.time() > RESOLVE_CACHE_MARGIN + horizon
+        if item["url"] and fresh:
+            return item["url"]
+        if not item.get("page_url"):
+            return item["url"]  # fichier local ou flux brut : rien à rafraîchir
+
+        # le préchargement et le lecteur peuvent demander le même item : une seule résolution
+        task = self._refreshing.get(id(item))
+        if task is None:
+            task = asyncio.ensure_future(self._refresh_stream(item))
+            self._refreshing[id(item)] = task
+            task.add_done_callback(lambda _t, key=id(item): self._refreshing.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _refresh_stream(self, item: dict) -> Optional[str]:
+        info = await extract_cached(item["page_url"], self.guild_id)
+        if info is None or not info.get("url"):
+            return None
+        item["url"] = info["url"]
+        item["expires"] = stream_expiry(info["url"])
+        # info peut venir du cache mémoire : l'âge compte depuis l'extraction, pas depuis maintenant
+        ttl_left = resolve_cache.ttl_left(item["page_url"])
+        item["resolved_at"] = time.time() - (RESOLVE_CACHE_TTL - ttl_left if ttl_left is not None else 0.0)
+        item["title"] = info.get("title") or item["title"]
+        item["duration"] = info.get("duration") or item.get("duration")
+        item["acodec"] = info.get("acodec")
+        return item["url"]
+
+    def schedule_prefetch(self):
+        """Lance (si besoin) le préchargement des prochains items de la queue"""
+        if self.prefetch_window <= 0:
+            return
+        if self.prefetch_task is None or self.prefetch_task.done():
+            self.prefetch_task = asyncio.create_task(self.prefetch_next())
+
+    def cancel_prefetch(self):
+        if self.prefetch_task and not self.prefetch_task.done():
+            self.prefetch_task.cancel()
+        self.prefetch_task = None
+
+    async def prefetch_next(self):
+        """Résout (ou revalide) les prochains items pendant que le morceau courant joue"""
+        upcoming = self.queue.peek(0, self.prefetch_window)
+        horizon = (self.playing_item or {}).get("duration") or 0.0
+        for item in upcoming:
+            try:
+                await self.ensure_stream(item, horizon)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # le lecteur réessaiera (et signalera l'erreur) au moment de jouer l'item
+                print(f"Prefetch error ({item['title']}): {e}")
+            horizon += item.get("duration") or 0.0
+
+    async def open_source(self, item: dict) -> Optional[PrimedSource]:
+        """Résout l'item puis lance FFmpeg et amorce ses premières trames, hors de l'event loop"""
+        stream_url = await self.ensure_stream(item)
+        if not stream_url:
+            return None
+        return await open_primed_source_async(stream_url, item.get("acodec"), self, item.get("resume_at", 0.0), item)
+
+    async def set_volume(self, volume: float):
+        """Change le volume de la guild : effet à la trame suivante
+
+        Un flux Opus en passthrough ne peut pas être atténué : il est rouvert en PCM à la
+        même position puis substitué dans la chaîne. Les morceaux déjà amorcés en Opus sont
+        remis en tête de file, ils seront rouverts en PCM. Si la réouverture échoue (superviseur
+        saturé, délai), l'ancien volume et l'ancienne source sont conservés et l'erreur remonte.
+        """
+        previous, self.volume = self.volume, volume
+        chain = self.chain
+        if volume == 1.0:
+            return
+        if chain is not None and chain.source.is_opus():
+            try:
+                ensure_encoder(self.voice_client)  # lecture démarrée en Opus : play() n'a pas créé d'encodeur
+                item, start_frame = chain.item, chain.frames
+                source = await open_primed_source_async(item["url"], None, self, start_frame * FRAME_SECONDS,
+                                                        replacing=supervised_rec(chain.source))
+            except BaseException:
+                self.volume = previous
+                raise
+            if chain.item is not item or not chain.replace_current(source, start_frame):
+                discard_source(source)  # morceau terminé ou passé entre-temps
+        self.requeue_primed_opus()
+
+    def requeue_primed_opus(self):
+        """Remet en tête de file les morceaux amorcés en Opus (gain impossible), sources fermées"""
+        primed = []
+        if self._carry is not None and self._carry[0].is_opus():
+            primed.append(self._carry)
+            self._carry = None
+        chain = self.chain
+        if chain is not None and chain._next is not None and chain._next[0].is_opus():
+            source = chain._next[0]
+            item = chain.drop_next(cleanup=False)  # None si le thread audio vient d'y passer (il le refusera)
+            if item is not None:
+                primed.append((source, item))
+        for source, item in reversed(primed):
+            discard_source(source)
+            self.queue.appendleft(item)
+
+    async def now_playing(self, ctx, item: dict):
+        self.touch()
+        self.persist()
+        requested = item.pop("requested_at", None)
+        if requested is not None:
+            TIME_TO_FIRST_AUDIO.observe(time.monotonic() - requested)
+        self.current_song = item["title"]
+        self.playing_item = item
+        if self.state != "paused":
+            self.state = "playing"
+        self.schedule_prefetch()
+        duration = f" [{format_duration(item['duration'])}]" if item.get("duration") else ""
+        outbox.panel(ctx, f"▶️ Lecture : {item['title']}{duration}")
+
+    async def queue_gapless(self, ctx, chain: TrackChain):
+        """Amorce le prochain morceau de la queue dans la chaîne, avant la fin du courant"""
+        item = self.queue.popleft()
+        try:
+            # le courant est peut-être en Opus (play() n'a alors pas créé d'encodeur) et le suivant en PCM
+            ensure_encoder(self.voice_client)
+            source = await self.open_source(item)
+        except asyncio.TimeoutError:
+            outbox.say(ctx, f"❌ Délai dépassé pour : {item['title']}")
+            return
+        except Exception as e:
+            outbox.say(ctx, f"❌ Erreur de lecture: {e}")
+            return
+        if source is None:
+            outbox.say(ctx, f"❌ Aucun flux audio pour : {item['title']}")
+            return
+        if not chain._accepts(source):
+            # volume changé pendant l'ouverture en Opus : on réamorce, en PCM cette fois
+            discard_source(source)
+            self.queue.appendleft(item)
+            if self._wake is not None:
+                self._wake.set()
+            return
+        if not chain.queue_next(source, item):
+            # le morceau courant s'est terminé pendant l'amorçage : il sera joué au tour suivant
+            self._carry = (source, item)
+
     async def player_loop(self, ctx):
-        """Lit en boucle tout ce qui arrive dans la queue"""
-        while not self.stopped:
-            item = await self.queue.get()  # attend si vide
-            title, stream_url = item["title"], item["url"]
+        """Lit en boucle tout ce qui arrive dans la queue
 
-            # Si un morceau joue, stop pour enchaîner proprement
-            if self.voice_client and self.voice_client.is_playing():
-                self.voice_client.stop()
-                await asyncio.sleep(0.5)
+        Entièrement piloté par événements : la task dort sur la queue quand la guild est
+        inactive, et sur _wake pendant un morceau (fin, changement, amorçage du suivant).
+        """
+        loop = asyncio.get_running_loop()
+        while not self.stopped:
+            if self._carry is not None:
+                source, item = self._carry
+                self._carry = None
+            else:
+                item = await self.queue.get()  # attend si vide
+                source = None
 
             try:
-                # Crée la source FFmpeg
-                if FFMPEG_PATH:
-                    source = discord.FFmpegPCMAudio(stream_url, executable=FFMPEG_PATH, **ffmpeg_options)
-                else:
-                    source = discord.FFmpegPCMAudio(stream_url, **ffmpeg_options)
+                # Résolution juste à temps + FFmpeg lancé et amorcé hors de l'event loop
+                if source is None:
+                    source = await self.open_source(item)
+                if source is None:
+                    outbox.say(ctx, f"❌ Aucun flux audio pour : {item['title']}")
+                    continue
 
-                self.next_event = asyncio.Event()
-                self.current_song = title
+                wake = self._wake = asyncio.Event()
+                chain = TrackChain(source, item, notify=lambda: loop.call_soon_threadsafe(wake.set), owner=self)
+                chain.frames = int(item.pop("resume_at", 0.0) / FRAME_SECONDS)  # reprise après redémarrage
 
                 def _after(err):
-                    # callback thread → on rebondit sur l’event loop
+                    # callback du thread audio → on rebondit sur la loop capturée
                     if err:
                         print(f"Player error: {err}")
-                    if self.next_event and not self.next_event.is_set():
-                        asyncio.run_coroutine_threadsafe(self._signal_next(), asyncio.get_event_loop())
+                    chain.finished = True
+                    loop.call_soon_threadsafe(wake.set)
 
                 if self.voice_client:
-                    self.voice_client.play(source, after=_after)
-                    await ctx.send(f"▶️ Lecture : {title}")
-
-                    # Attendre la fin
-                    while self.voice_client and (self.voice_client.is_playing() or self.voice_client.is_paused()):
-                        if self.next_event:
-                            try:
-                                await asyncio.wait_for(self.next_event.wait(), timeout=0.5)
-                            except asyncio.TimeoutError:
-                                pass
-                        else:
-                            await asyncio.sleep(0.5)
+                    self.chain = chain
+                    self.voice_client.play(chain, after=_after)
+                    await self.now_playing(ctx, item)
+
+                    # Attendre la fin (la chaîne peut enchaîner plusieurs morceaux sans s'arrêter)
+                    while not chain.finished:
+                        await wake.wait()
+                        wake.clear()
+                        if chain.item is not item:
+                            # le thread audio est passé au morceau amorcé
+                            item = chain.item
+                            await self.now_playing(ctx, item)
+                        if self.gapless and chain.wants_next() and not self.queue.empty():
+                            await self.queue_gapless(ctx, chain)
+                    if chain.refused is not None:
+                        # amorcé en Opus avant un changement de volume : rouvert en PCM au tour suivant
+                        source, refused = chain.refused
+                        chain.refused = None
+                        discard_source(source)
+                        if not self.stopped:
+                            self.queue.appendleft(refused)
+                else:
+                    discard_source(source)
 
+            except asyncio.TimeoutError:
+                outbox.say(ctx, f"❌ Délai dépassé pour : {item['title']}")
             except Exception as e:
-                await ctx.send(f"❌ Erreur de lecture: {e}")
+                outbox.say(ctx, f"❌ Erreur de lecture: {e}")
 
             finally:
-                self.queue.task_done()
+                self._wake = None
+                self.chain = None
                 self.current_song = None
-
-    async def _signal_next(self):
-        if self.next_event and not self.next_event.is_set():
-            self.next_event.set()
+                self.playing_item = None
+                self.state = "idle"
+                self.touch()  # l'inactivité se compte à partir de la fin du dernier morceau
+                self.persist()
 
     async def play_file(self, ctx, file_path):
         """Envoie un fichier local dans la queue"""
         if not os.path.exists(file_path):
-            await ctx.send(f"❌ Fichier non trouvé : {file_path}")
+            outbox.say(ctx, f"❌ Fichier non trouvé : {file_path}")
             return
         if not await self.join_channel(ctx):
             return
         if self.voice_client is None:
             return
 
+        # métadonnées ffprobe déjà en cache (tâche de fond) : rien n'est sondé ici
+        meta = local_probes.lookup(file_path) or {}
+        tags = meta.get("tags") or {}
         title = os.path.basename(file_path)
-        await self.enqueue_stream(title, file_path)
+        if tags.get("title"):
+            title = f"{tags['artist']} - {tags['title']}" if tags.get("artist") else tags["title"]
+        # version pré-transcodée en Opus si elle existe : lue telle quelle, sans FFmpeg
+        opus_path = opus_cache.lookup(meta)
+        if opus_path:
+            track = make_track(title, opus_path, duration=meta.get("duration"), acodec="opus")
+        else:
+            track = make_track(title, file_path, duration=meta.get("duration"), acodec=meta.get("codec"))
+        await self.enqueue_track(track)
         await self.ensure_player(ctx)
-        await ctx.send(f"➕ Ajouté à la file : {title}")
+        outbox.say(ctx, f"➕ Ajouté à la file : {title}")
 
     async def play_url(self, ctx, url):
         """Résout un lien (track OU playlist) et alimente la queue"""
         if not await self.join_channel(ctx):
             return
-        await ctx.send("🔄 Récupération du lien...")
+        # lien en cache : la réponse part seule, sans message d'attente à côté
+        notice = outbox.later(ctx, "🔄 Récupération du lien...", SLOW_NOTICE_DELAY)
 
         try:
-            items = await self.resolve_url(url)
+            items = await self.resolve_url(url, ctx.guild.id if ctx.guild else None)
+            notice.cancel()
             if not items:
-                await ctx.send("❌ Aucun flux audio trouvé")
+                outbox.say(ctx, "❌ Aucun flux audio trouvé")
                 return
 
-            # Empile tout (si playlist → plusieurs titres)
-            for title, stream_url in items:
-                await self.enqueue_stream(title, stream_url)
+            # Empile tout d'un coup (si playlist → plusieurs titres)
+            await self.enqueue_many(items)
 
             await self.ensure_player(ctx)
             if len(items) == 1:
-                await ctx.send(f"➕ Ajouté à la file : {items[0][0]}")
+                outbox.say(ctx, f"➕ Ajouté à la file : {items[0]['title']}")
             else:
-                await ctx.send(f"🎶 **{len(items)}** titres ajoutés à la file")
+                outbox.say(ctx, f"🎶 **{len(items)}** titres ajoutés à la file")
 
+        except asyncio.TimeoutError:
+            outbox.say(ctx, "❌ Délai dépassé pendant la récupération du lien")
         except Exception as e:
             error_msg = str(e).lower()
             if "private" in error_msg or "unavailable" in error_msg:
-                await ctx.send("❌ Cette musique est privée ou indisponible")
+                outbox.say(ctx, "❌ Cette musique est privée ou indisponible")
             elif "geo" in error_msg or "location" in error_msg:
-                await ctx.send("❌ Cette musique est bloquée dans votre région")
+                outbox.say(ctx, "❌ Cette musique est bloquée dans votre région")
             elif "copyright" in error_msg:
-                await ctx.send("❌ Problème de droits d'auteur")
+                outbox.say(ctx, "❌ Problème de droits d'auteur")
             else:
-                await ctx.send(f"❌ Erreur lors du téléchargement : {str(e)}")
+                outbox.say(ctx, f"❌ Erreur lors du téléchargement : {str(e)}")
+        finally:
+            notice.cancel()
+
+GUILD_IDLE_TIMEOUT = int(os.getenv("GUILD_IDLE_TIMEOUT", "900"))  # secondes, 0 = jamais libérer
+GUILD_SWEEP_INTERVAL = 60
 
 class MusicBotManager:
-    """Un MusicBot par serveur (guild)"""
-    def __init__(self):
-        self.bots = {}  # {guild_id: MusicBot}
+    """Un MusicBot par serveur (guild), libéré après GUILD_IDLE_TIMEOUT d'inactivité"""
+    def __init__(self, idle_timeout: int = GUILD_IDLE_TIMEOUT):
+        self.bots: Dict[int, MusicBot] = {}
+        self.idle_timeout = idle_timeout
+        self.sweep_task: Optional[asyncio.Task] = None
+        self.evicted = 0
 
     def get_bot(self, guild_id: int) -> MusicBot:
         if guild_id not in self.bots:
-            self.bots[guild_id] = MusicBot()
-        return self.bots[guild_id]
+            music_bot = self.bots[guild_id] = MusicBot(guild_id)
+            snap = queue_store.take(guild_id)
+            if snap is not None:
+                music_bot.restore(snap)  # file d'avant le redémarrage, résolue au fil de la lecture
+        music_bot = self.bots[guild_id]
+        music_bot.touch()
+        return music_bot
+
+    def start(self):
+        if self.idle_timeout > 0 and (self.sweep_task is None or self.sweep_task.done()):
+            self.sweep_task = asyncio.create_task(self.sweep_forever())
+
+    async def sweep_forever(self, interval: float = GUILD_SWEEP_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.evict_idle()
+            except Exception as e:
+                print(f"Guild sweep error: {e}")
+
+    def is_paused(self, guild_id: int) -> bool:
+        """Lecture de la guild en pause (appelé depuis le thread de surveillance FFmpeg)"""
+        music_bot = self.bots.get(guild_id)
+        vc = music_bot.voice_client if music_bot is not None else None
+        return vc is not None and vc.is_paused()
+
+    async def evict_idle(self) -> int:
+        """Déconnecte et oublie les guilds inactives depuis idle_timeout"""
+        evicted = 0
+        for gid in list(self.bots):
+            music_bot = self.bots.get(gid)
+            # re-vérifié à chaque tour : une commande a pu arriver pendant la fermeture précédente
+            if music_bot is None or music_bot.idle_for(time.monotonic()) < self.idle_timeout:
+                continue
+            del self.bots[gid]
+            await music_bot.close()
+            evicted += 1
+        if evicted:
+            self.evicted += evicted
+            print(f"{evicted} guild(s) inactive(s) libérée(s), {len(self.bots)} active(s)")
+        return evicted
 
 music_manager = MusicBotManager()
+ffmpeg_supervisor.is_paused = music_manager.is_paused
+
+def _guild_gauges() -> Dict[Tuple, float]:
+    bots = list(music_manager.bots.values())
+    voice = sum(1 for b in bots if b.voice_client is not None and b.voice_client.is_connected())
+    depths = [len(b.queue) for b in bots]
+    return {(("what", "guilds"),): len(bots),
+            (("what", "playing"),): sum(1 for b in bots if b.state == "playing"),
+            (("what", "voice_connections"),): voice,
+            (("what", "queued_tracks"),): sum(depths),
+            (("what", "max_queue_depth"),): max(depths, default=0)}
+
+def _cache_counters(field: str) -> Callable[[], Dict[Tuple, float]]:
+    def collect():
+        return {(("cache", "resolve"),): resolve_cache.stats()[field],
+                (("cache", "metadata"),): metadata_store.stats()[field],
+                (("cache", "tracks"),): track_cache.stats()[field]}
+    return collect
+
+metrics.register(GaugeMetric("botmusic_guilds", "Guilds suivies par ce process (actives, en lecture, en vocal, file)",
+                             _guild_gauges))
+metrics.register(CollectedCounter("botmusic_guilds_evicted_total", "Guilds libérées pour inactivité",
+                                  lambda: {(): music_manager.evicted}))
+metrics.register(GaugeMetric("botmusic_resolver_tasks", "Extractions yt-dlp en attente / en cours",
+                             lambda: {(("state", k),): v for k, v in resolver.stats().items()
+                                      if k in ("waiting", "running")}))
+metrics.register(CollectedCounter("botmusic_resolve_shared_total",
+                                  "Demandes servies par une extraction identique déjà en cours",
+                                  lambda: {(): resolver.stats()["shared"]}))
+metrics.register(GaugeMetric("botmusic_ffmpeg_processes", "Process FFmpeg supervisés en cours",
+                             lambda: {(): ffmpeg_supervisor.stats()["running"]}))
+metrics.register(GaugeMetric("botmusic_ffmpeg_cpu_cores", "CPU des FFmpeg supervisés (en cœurs)",
+                             lambda: {(): ffmpeg_supervisor.stats()["cpu"]}))
+metrics.register(GaugeMetric("botmusic_ffmpeg_rss_bytes", "Mémoire résidente des FFmpeg supervisés",
+                             lambda: {(): ffmpeg_supervisor.stats()["rss"]}))
+metrics.register(CollectedCounter("botmusic_ffmpeg_killed_total", "FFmpeg tués par le superviseur, par raison",
+                                  lambda: {(("reason", r),): n for r, n in ffmpeg_supervisor.stats()["killed"].items()}))
+metrics.register(CollectedCounter("botmusic_ffmpeg_rejected_total", "Lancements refusés faute de place",
+                                  lambda: {(): ffmpeg_supervisor.rejected}))
+metrics.register(CollectedCounter("botmusic_cache_hits_total", "Hits par cache", _cache_counters("hits")))
+metrics.register(CollectedCounter("botmusic_cache_misses_total", "Miss par cache", _cache_counters("misses")))
+
+async def resume_playing_guilds():
+    """Relance la lecture des guilds qui jouaient avant le redémarrage (les autres attendent une commande)"""
+    sem = asyncio.Semaphore(RESTORE_CONCURRENCY)
+
+    async def _resume(snap):
+        guild = bot.get_guild(snap["g"])
+        voice = guild.get_channel(snap.get("voice")) if guild and snap.get("voice") else None
+        text = guild.get_channel(snap.get("text")) if guild and snap.get("text") else None
+        if voice is None or text is None:
+            return  # salon disparu : la file reste disponible pour la prochaine commande
+        async with sem:
+            music_bot = music_manager.get_bot(guild.id)
+            try:
+                if music_bot.voice_client is None:
+                    music_bot.voice_client = await voice.connect()
+                await music_bot.ensure_player(text)
+            except Exception as e:
+                print(f"Reprise impossible ({guild.id}): {e}")
+
+    snaps = queue_store.pending_playing()
+    await asyncio.gather(*(_resume(snap) for snap in snaps))
+    if snaps:
+        print(f"Lecture reprise dans {len(snaps)} guild(s)")
+
+async def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT):
+    async def handle(request):
+        return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"Métriques : http://{host}:{port}/metrics")
+    return runner
+
+# Chien de garde de l'event loop : un thread remarque quand la loop ne répond plus et note où elle est
+WATCHDOG_THRESHOLD = float(os.getenv("WATCHDOG_THRESHOLD", "0.25"))  # secondes, 0 = pas d'échantillonnage
+WATCHDOG_LOG = os.getenv("WATCHDOG_LOG", "botmusic_blocking.log")    # journal tournant, vide = désactivé
+WATCHDOG_LOG_BYTES = 1_000_000
+WATCHDOG_LOG_BACKUPS = 3
+WATCHDOG_HISTORY = 50  # blocages gardés en mémoire pour !watchdog
+WATCHDOG_STACK_DEPTH = 12
+HEARTBEAT_INTERVAL = 0.1
+
+class LoopWatchdog:
+    """Mesure le retard de la loop en continu ; au-delà du seuil, échantillonne sa pile depuis un thread
+
+    La coroutine heartbeat note l'heure à chaque réveil. Si elle se tait plus de threshold secondes,
+    le thread de surveillance lit la pile du thread de la loop (sys._current_frames) pendant le
+    blocage : commande en cours, task et code fautif. L'incident est clôturé, mesuré et journalisé
+    quand la loop reprend.
+    """
+    def __init__(self, threshold: float = WATCHDOG_THRESHOLD, log_path: str = WATCHDOG_LOG):
+        self.threshold = threshold
+        self.log_path = log_path
+        self.incidents = deque(maxlen=WATCHDOG_HISTORY)
+        self._beat = time.monotonic()
+        self._stall: Optional[dict] = None  # échantillon du blocage en cours
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._commands: Dict = {}  # code des callbacks -> nom de commande
+        self.heartbeat_task: Optional[asyncio.Task] = None
+        self.logger = logging.getLogger("botmusic.watchdog")
+        self.logger.propagate = False  # pas dans la sortie de discord.py
+
+    def start(self):
+        if self.log_path and not self.logger.handlers:
+            handler = RotatingFileHandler(self.log_path, maxBytes=WATCHDOG_LOG_BYTES,
+                                          backupCount=WATCHDOG_LOG_BACKUPS, encoding="utf-8", delay=True)
+            handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            self.logger.addHandler(handler)
+            self.logger.setLevel(logging.INFO)
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._commands = {cmd.callback.__code__: cmd.qualified_name for cmd in bot.walk_commands()}
+        self._beat = time.monotonic()
+        self.heartbeat_task = asyncio.create_task(self.heartbeat())
+        if self.threshold > 0:
+            threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+    async def heartbeat(self, interval: float = HEARTBEAT_INTERVAL):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            lag = max(0.0, loop.time() - start - interval)
+            self._beat = time.monotonic()
+            LOOP_LAG.set(lag)
+            LOOP_LAG_SECONDS.observe(lag)
+            if self.threshold > 0 and lag >= self.threshold:
+                self._close_incident(lag)
+
+    def _watch(self):
+        while True:
+            time.sleep(self.threshold / 4)
+            silent = time.monotonic() - self._beat - HEARTBEAT_INTERVAL
+            if silent < self.threshold:
+                continue
+            with self._lock:
+                if self._stall is None:  # un seul échantillon par blocage
+                    self._stall = self._sample()
+
+    def _sample(self) -> dict:
+        """Pile actuelle du thread de la loop (appelé depuis le thread de surveillance)"""
+        frame = sys._current_frames().get(self._loop_thread)
+        command = None
+        walk = frame
+        while walk is not None and command is None:
+            command = self._commands.get(walk.f_code)
+            walk = walk.f_back
+        try:
+            task = asyncio.current_task(self._loop)
+        except RuntimeError:
+            task = None
+        coro = getattr(task.get_coro(), "__qualname__", None) if task is not None else None
+        stack = []
+        if frame is not None:
+            stack = [f"{os.path.basename(fs.filename)}:{fs.lineno} {fs.name}"
+                     for fs in traceback.extract_stack(frame, limit=WATCHDOG_STACK_DEPTH)]
+        return {"command": command, "task": task.get_name() if task is not None else None,
+                "coro": coro, "stack": stack}
+
+    def _close_incident(self, seconds: float):
+        with self._lock:
+            sample, self._stall = self._stall, None
+        sample = sample or {"command": None, "task": None, "coro": None, "stack": []}  # trop court pour le thread
+        where = f"!{sample['command']}" if sample["command"] else (sample["coro"] or "inconnu")
+        incident = dict(sample, at=time.time(), seconds=round(seconds, 3), where=where)
+        self.incidents.append(incident)
+        LOOP_BLOCKED.inc(where=where)
+        LOOP_BLOCKED_SECONDS.observe(seconds)
+        self.logger.warning(json.dumps(incident, ensure_ascii=False))
+        top = sample["stack"][-1] if sample["stack"] else "pile non capturée"
+        print(f"⚠️ Event loop bloquée {seconds:.2f}s dans {where} ({top})")
+
+watchdog = LoopWatchdog()
+
+@bot.event
+async def setup_hook():
+    await metadata_store.warm()
+    await local_probes.load()
+    await opus_cache.load()
+    await asyncio.get_running_loop().run_in_executor(None, track_cache.load)
+    # une instance YoutubeDL prête par thread du Resolver : la première commande ne paie pas l'initialisation
+    await asyncio.get_running_loop().run_in_executor(None, ydl_pool.warm, RESOLVE_OPTS, RESOLVER_WORKERS)
+    restored = await queue_store.load()
+    if restored:
+        print(f"Files restaurées : {restored} guild(s)")
+    queue_store.start()
+    library.on_change = local_probes.schedule
+    if OPUS_CACHE:
+        local_probes.on_done = opus_cache.schedule
+    count = await library.refresh_async()
+    print(f"Bibliothèque : {count} fichier(s) indexé(s) dans {', '.join(MUSIC_DIRS)}")
+    library.start()
+    music_manager.start()
+    watchdog.start()
+    if METRICS_PORT:
+        bot.metrics_runner = await start_metrics_server()
+    if hasattr(signal, "SIGTERM"):
+        with contextlib.suppress(NotImplementedError):  # Windows : pas de signal handler sur la loop
+            # arrêt propre (systemd, cluster.py) : connexions vocales et gateway fermées
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM,
+                                                          lambda: asyncio.ensure_future(shutdown()))
+
+async def shutdown():
+    """Arrêt propre : files écrites sur disque avant de fermer les connexions"""
+    for music_bot in music_manager.bots.values():
+        queue_store.mark(music_bot)
+    try:
+        await queue_store.flush()
+    except Exception as e:
+        print(f"Queue store error: {e}")
+    # plus rien n'est écrit : la fermeture des connexions vocales viderait les files
+    queue_store.closed = True
+    if queue_store.task is not None:
+        queue_store.task.cancel()
+    ydl_pool.close()  # cookies écrits, sessions HTTP fermées
+    await bot.close()
+
+_resumed = False
 
 @bot.event
 async def on_ready():
-    print(f'{bot.user} est connecté !')
+    global _resumed
+    if not _resumed:  # on_ready revient à chaque reconnexion de la gateway
+        _resumed = True
+        asyncio.create_task(resume_playing_guilds())
+    if SHARD_COUNT:
+        print(f'{bot.user} est connecté ! (shards {SHARD_IDS or "tous"} / {SHARD_COUNT})')
+    else:
+        print(f'{bot.user} est connecté !')
+
+@bot.listen('on_command')
+async def _count_command_start(ctx):
+    ctx.metrics_started = time.perf_counter()
+
+@bot.listen('on_command_completion')
+async def _count_command_done(ctx):
+    _observe_command(ctx, "ok")
+
+@bot.listen('on_command_error')
+async def _count_command_error(ctx, error):
+    _observe_command(ctx, "error")
+
+def _observe_command(ctx, outcome: str):
+    name = ctx.command.qualified_name if ctx.command else "unknown"
+    COMMANDS.inc(command=name, outcome=outcome)
+    started = getattr(ctx, "metrics_started", None)
+    if started is not None:
+        COMMAND_SECONDS.observe(time.perf_counter() - started, command=name)
 
 # --- COMMANDES ---
 
@@ -222,22 +3237,20 @@ async def play(ctx, *, query):
     if query.startswith('http'):
         await music_bot.play_url(ctx, query)
     else:
-        if not query.endswith('.mp3'):
-            query += '.mp3'
-        possible_paths = [
-            os.path.join("music", query),
-            query,
-            os.path.join(".", query)
-        ]
-        file_path = None
-        for path in possible_paths:
-            if os.path.exists(path):
-                file_path = path
-                break
+        # chemin explicite d'abord, sinon recherche (approximative) dans la bibliothèque indexée
+        file_path = library.resolve_path(query)
         if file_path is None:
-            await ctx.send(f"❌ Fichier non trouvé : {query}")
-            await ctx.send("💡 Utilise `!list` pour voir les fichiers disponibles")
-            return
+            matches = library.search(query)
+            if not matches and time.time() - library.last_refresh > 10:
+                await library.refresh_async()  # fichier peut-être ajouté depuis le dernier scan
+                matches = library.search(query)
+            if not matches:
+                outbox.say(ctx, f"❌ Fichier non trouvé : {query}")
+                outbox.say(ctx, "💡 Utilise `!list` pour voir les fichiers disponibles")
+                return
+            file_path, score = matches[0]
+            if score < 1.0:
+                outbox.say(ctx, f"🔎 Meilleure correspondance : {os.path.basename(file_path)}")
         await music_bot.play_file(ctx, file_path)
 
 @bot.command(name='stop')
@@ -247,16 +3260,8 @@ async def stop(ctx):
         return
     music_bot = music_manager.get_bot(ctx.guild.id)
 
-    music_bot.stopped = True
-    try:
-        while not music_bot.queue.empty():
-            music_bot.queue.get_nowait()
-            music_bot.queue.task_done()
-    except Exception:
-        pass
-    if music_bot.voice_client and (music_bot.voice_client.is_playing() or music_bot.voice_client.is_paused()):
-        music_bot.voice_client.stop()
-    await ctx.send("⏹️ Musique arrêtée et file vidée")
+    music_bot.stop()
+    outbox.say(ctx, "⏹️ Musique arrêtée et file vidée")
 
 @bot.command(name='pause')
 async def pause(ctx):
@@ -265,9 +3270,8 @@ async def pause(ctx):
         return
     music_bot = music_manager.get_bot(ctx.guild.id)
 
-    if music_bot.voice_client and music_bot.voice_client.is_playing():
-        music_bot.voice_client.pause()
-        await ctx.send("⏸️ Musique en pause")
+    if music_bot.pause():
+        outbox.say(ctx, "⏸️ Musique en pause")
 
 @bot.command(name='resume')
 async def resume(ctx):
@@ -276,9 +3280,8 @@ async def resume(ctx):
         return
     music_bot = music_manager.get_bot(ctx.guild.id)
 
-    if music_bot.voice_client and music_bot.voice_client.is_paused():
-        music_bot.voice_client.resume()
-        await ctx.send("▶️ Musique reprise")
+    if music_bot.resume():
+        outbox.say(ctx, "▶️ Musique reprise")
 
 @bot.command(name='leave', aliases=['disconnect'])
 async def leave(ctx):
@@ -290,7 +3293,7 @@ async def leave(ctx):
     if music_bot.voice_client:
         await music_bot.voice_client.disconnect()
         music_bot.voice_client = None
-        await ctx.send("👋 Bot déconnecté")
+        outbox.say(ctx, "👋 Bot déconnecté")
 
 @bot.command(name='current', aliases=['now'])
 async def current(ctx):
@@ -300,26 +3303,42 @@ async def current(ctx):
     music_bot = music_manager.get_bot(ctx.guild.id)
 
     if music_bot.current_song:
-        await ctx.send(f"🎵 En cours : {music_bot.current_song}")
+        item = music_bot.playing_item or {}
+        duration = item.get("duration")
+        chain = music_bot.chain
+        position = f"{format_duration(chain.position())} / " if chain is not None and duration else ""
+        suffix = f" ({position}{format_duration(duration)})" if duration else ""
+        outbox.say(ctx, f"🎵 En cours : {music_bot.current_song}{suffix}")
     else:
-        await ctx.send("Aucune musique en cours")
+        outbox.say(ctx, "Aucune musique en cours")
+
+LIST_PAGE_SIZE = 20
 
 @bot.command(name='list', aliases=['ls'])
-async def list_music(ctx):
-    """Lister les fichiers MP3 disponibles"""
-    music_files = []
-    if os.path.exists("music"):
-        for file in os.listdir("music"):
-            if file.endswith(('.mp3', '.wav', '.m4a', '.flac')):
-                music_files.append(f"music/{file}")
-    for file in os.listdir("."):
-        if file.endswith(('.mp3', '.wav', '.m4a', '.flac')):
-            music_files.append(file)
-    if music_files:
-        files_list = "\n".join([f"• {os.path.basename(file)}" for file in music_files[:15]])
-        await ctx.send(f"🎵 **Fichiers disponibles :**\n```\n{files_list}\n```")
-    else:
-        await ctx.send("❌ Aucun fichier audio trouvé dans ./music/ ou le dossier courant")
+async def list_music(ctx, page: int = 1):
+    """Lister les fichiers audio disponibles (par pages)"""
+    total = len(library)
+    if total == 0:
+        outbox.say(ctx, f"❌ Aucun fichier audio trouvé dans {', '.join(MUSIC_DIRS)}")
+        return
+    pages = (total + LIST_PAGE_SIZE - 1) // LIST_PAGE_SIZE
+    page = min(max(page, 1), pages)
+    files_list = "\n".join(f"• {os.path.splitext(os.path.basename(f))[0]}"
+                           for f in library.page(page, LIST_PAGE_SIZE))
+    outbox.say(ctx, f"🎵 **Fichiers disponibles** (page {page}/{pages}, {total} au total) :\n```\n{files_list}\n```")
+
+@bot.command(name='rescan')
+async def rescan(ctx):
+    """Relire la bibliothèque locale (seuls les dossiers modifiés sont relus, les fichiers re-vérifiés)"""
+    changes = await library.refresh_async()
+    outbox.say(ctx, f"📂 Bibliothèque à jour : {changes} changement(s), {len(library)} fichiers")
+
+@bot.command(name='transcode')
+async def transcode(ctx):
+    """Pré-transcoder la bibliothèque en Opus (lecture ensuite sans FFmpeg)"""
+    opus_cache.schedule()
+    outbox.say(ctx, f"🎛️ Transcodage Opus lancé en arrière-plan ({len(library)} fichiers, "
+                    f"{opus_cache.transcoded} déjà faits cette session)")
 
 @bot.command(name='playforce')
 async def playforce(ctx, *, url):
@@ -330,104 +3349,221 @@ async def playforce(ctx, *, url):
 
     if not await music_bot.join_channel(ctx):
         return
-    await ctx.send("🔄 Force download...")
+    outbox.say(ctx, "🔄 Force download...", immediate=True)  # la résolution peut prendre des secondes
 
     try:
         simple_opts = {
             'format': 'worst[acodec!=none]/bestaudio/best',
             'quiet': True,
-            'no_warnings': True
+            'no_warnings': True,
+            'cachedir': ydl_opts.get('cachedir'),
         }
-        with yt_dlp.YoutubeDL(simple_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            title = info.get('title', 'Titre inconnu')
-            formats = info.get('formats', [])
-            stream_url = None
-            for fmt in formats:
-                if fmt.get('acodec') and fmt.get('acodec') != 'none':
-                    stream_url = fmt.get('url')
-                    break
-            if not stream_url:
-                stream_url = info.get('url')
-            if not stream_url:
-                await ctx.send("❌ Aucun stream trouvé")
-                return
+        info = await resolver.extract(url, simple_opts, guild_id=ctx.guild.id)
+        title = info.get('title', 'Titre inconnu')
+        formats = info.get('formats', [])
+        stream_url = None
+        for fmt in formats:
+            if fmt.get('acodec') and fmt.get('acodec') != 'none':
+                stream_url = fmt.get('url')
+                break
+        if not stream_url:
+            stream_url = info.get('url')
+        if not stream_url:
+            outbox.say(ctx, "❌ Aucun stream trouvé")
+            return
 
-            # Ici, on empile aussi dans la queue pour rester cohérent
-            await music_bot.enqueue_stream(title, stream_url)
-            await music_bot.ensure_player(ctx)
-            await ctx.send(f"🔧 **Force basic** : {title}")
+        # Ici, on empile aussi dans la queue pour rester cohérent
+        await music_bot.enqueue_stream(title, stream_url)
+        await music_bot.ensure_player(ctx)
+        outbox.say(ctx, f"🔧 **Force basic** : {title}")
 
+    except asyncio.TimeoutError:
+        outbox.say(ctx, "❌ Délai dépassé pendant la récupération du lien")
     except Exception as e:
-        await ctx.send(f"❌ Erreur générale : {str(e)}")
+        outbox.say(ctx, f"❌ Erreur générale : {str(e)}")
 
 @bot.command(name='formats')
 async def show_formats(ctx, *, url):
     """Voir tous les formats disponibles"""
     try:
-        with yt_dlp.YoutubeDL({'quiet': True}) as ydl:
-            info = ydl.extract_info(url, download=False)
-            formats = info.get('formats', [])
-            format_list = []
-            for i, fmt in enumerate(formats[:10]):
-                codec = fmt.get('acodec', 'none')
-                ext = fmt.get('ext', 'unknown')
-                quality = fmt.get('abr', 'unknown')
-                format_list.append(f"{i}: {codec} | {ext} | {quality}kbps")
-            formats_text = "\n".join(format_list)
-            await ctx.send(f"🎵 **Formats disponibles:**\n```\n{formats_text}\n```")
+        info = await extract_cached(url, ctx.guild.id if ctx.guild else None, need_stream=False)
+        if info is None:
+            outbox.say(ctx, "❌ Aucune info trouvée")
+            return
+        formats = info.get('formats', [])
+        format_list = []
+        for i, fmt in enumerate(formats[:10]):
+            codec = fmt.get('acodec', 'none')
+            ext = fmt.get('ext', 'unknown')
+            quality = fmt.get('abr', 'unknown')
+            format_list.append(f"{i}: {codec} | {ext} | {quality}kbps")
+        formats_text = "\n".join(format_list)
+        outbox.say(ctx, f"🎵 **Formats disponibles:**\n```\n{formats_text}\n```")
+    except asyncio.TimeoutError:
+        outbox.say(ctx, "❌ Erreur formats : délai dépassé")
     except Exception as e:
-        await ctx.send(f"❌ Erreur formats : {e}")
+        outbox.say(ctx, f"❌ Erreur formats : {e}")
 
 @bot.command(name='debug')
 async def debug(ctx, *, url):
     """Debug un lien (titre, durée, url, nb de formats)"""
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            title = info.get('title', 'Titre inconnu')
-            stream_url = info.get('url')
-            duration = info.get('duration', 'Inconnue')
-            formats = info.get('formats', [])
-            debug_msg = f"""
+        info = await extract_cached(url, ctx.guild.id if ctx.guild else None)
+        if info is None:
+            outbox.say(ctx, "❌ Aucune info trouvée")
+            return
+        title = info.get('title', 'Titre inconnu')
+        stream_url = info.get('url')
+        duration = info.get('duration', 'Inconnue')
+        formats = info.get('formats', [])
+        entries = info.get('entries')
+        ttl = resolve_cache.ttl_left(url)
+        debug_msg = f"""
 🔍 **Debug Info:**
 **Titre:** {title}
 **Durée:** {duration}s
 **Stream URL:** {"✅ Trouvée" if stream_url else "❌ Manquante"}
 **Formats disponibles:** {len(formats)}
-            """
-            await ctx.send(debug_msg)
+**Entrées (playlist):** {len(entries) if entries is not None else "-"}
+**Cache:** {f"encore {int(ttl)}s" if ttl is not None else "non mis en cache"}
+        """
+        outbox.say(ctx, debug_msg)
+    except asyncio.TimeoutError:
+        outbox.say(ctx, "❌ Erreur debug : délai dépassé")
     except Exception as e:
-        await ctx.send(f"❌ Erreur debug : {e}")
+        outbox.say(ctx, f"❌ Erreur debug : {e}")
+
+@bot.command(name='resolver')
+async def resolver_stats(ctx):
+    """Afficher l'état du pool de résolution yt-dlp"""
+    st = resolver.stats()
+    cache = resolve_cache.stats()
+    disk = metadata_store.stats()
+    tracks = track_cache.stats()
+    ydl = ydl_pool.stats()
+    outbox.say(ctx,
+        f"🧵 **Résolveur** : {st['running']}/{st['workers']} en cours, {st['waiting']} en attente\n"
+        f"✅ {st['completed']} ok | ❌ {st['failed']} erreurs | ⏱️ {st['timeouts']} timeouts | "
+        f"🚫 {st['cancelled']} annulés | 🧱 {st['rejected']} refusés | 🔗 {st['shared']} partagés\n"
+        f"♻️ **YoutubeDL** : {ydl['idle']} prêtes | {ydl['created']} créées | {ydl['reused']} réutilisées\n"
+        f"🗃️ **Cache** : {cache['entries']} entrées | {cache['hits']} hits | {cache['misses']} miss | "
+        f"{cache['expired']} expirées\n"
+        f"💾 **Disque** : {disk['hot']} préchargées | {disk['hits']} hits | {disk['misses']} miss | "
+        f"{disk['evicted']} évincées\n"
+        f"🎞️ **Morceaux** : {tracks['entries']} en cache ({tracks['bytes'] // 2**20}/"
+        f"{tracks['max_bytes'] // 2**20} Mo) | {tracks['hits']} hits | {tracks['misses']} miss | "
+        f"{tracks['aborted']} copies abandonnées"
+    )
+
+@bot.command(name='ffmpeg')
+async def ffmpeg_report(ctx):
+    """Process FFmpeg en cours (places, CPU, mémoire)"""
+    st = ffmpeg_supervisor.stats()
+    killed = ", ".join(f"{n} {r}" for r, n in st["killed"].items()) or "aucun"
+    lines = [f"🎛️ **FFmpeg** : {st['running']}/{st['max']} en cours sur {st['guilds']} guild(s) | "
+             f"CPU {st['cpu'] * 100:.0f}% | {st['rss'] // 2**20} Mo",
+             f"🚀 {st['spawned']} lancés | 🧱 {st['rejected']} refusés | 🧹 {st['reaped']} ramassés | "
+             f"🔪 tués : {killed}"]
+    if ctx.guild is not None:
+        now = time.monotonic()
+        for rec in ffmpeg_supervisor.processes():
+            if rec.guild_id == ctx.guild.id:
+                lines.append(f"`{rec.pid}` {rec.mode} | {now - rec.started:.0f}s | CPU {rec.cpu * 100:.1f}% | "
+                             f"{rec.rss // 2**20} Mo")
+    outbox.say(ctx, "\n".join(lines))
+
+@bot.command(name='watchdog')
+async def watchdog_report(ctx, count: int = 5):
+    """Derniers blocages de l'event loop détectés"""
+    incidents = list(watchdog.incidents)[-max(1, min(count, 15)):]
+    if not incidents:
+        outbox.say(ctx, f"🐕 Aucun blocage de plus de {watchdog.threshold:.2f}s depuis le démarrage")
+        return
+    lines = [f"🐕 **Blocages de l'event loop** ({len(watchdog.incidents)} récents)"]
+    for inc in reversed(incidents):
+        when = time.strftime("%H:%M:%S", time.localtime(inc["at"]))
+        top = inc["stack"][-1] if inc["stack"] else "pile non capturée"
+        lines.append(f"`{when}` {inc['seconds']:.2f}s dans **{inc['where']}** — `{top}`")
+    outbox.say(ctx, "\n".join(lines))
 
 @bot.command(name='volume')
 async def volume(ctx, vol: int = None):
     """Changer le volume (0-100)"""
+    if ctx.guild is None:
+        return
     if vol is None:
-        await ctx.send("Usage: `!volume <0-100>`")
+        outbox.say(ctx, "Usage: `!volume <0-100>`")
         return
     if vol < 0 or vol > 100:
-        await ctx.send("Volume doit être entre 0 et 100")
+        outbox.say(ctx, "Volume doit être entre 0 et 100")
         return
-    volume_float = vol / 100
-    global ffmpeg_options
-    ffmpeg_options['options'] = f'-vn -filter:a "volume={volume_float}"'
-    await ctx.send(f"🔊 Volume réglé à {vol}%")
+    music_bot = music_manager.get_bot(ctx.guild.id)
+    try:
+        await music_bot.set_volume(vol / 100)
+    except asyncio.TimeoutError:
+        outbox.say(ctx, f"❌ Délai dépassé, volume inchangé ({round(music_bot.volume * 100)}%)")
+        return
+    except RuntimeError as e:
+        outbox.say(ctx, f"❌ {e} : volume inchangé ({round(music_bot.volume * 100)}%)")
+        return
+    outbox.say(ctx, f"🔊 Volume réglé à {vol}%")
+
+@bot.command(name='prefetch')
+async def prefetch(ctx, size: int = None):
+    """Régler combien de morceaux suivants sont résolus à l'avance (0 = désactivé)"""
+    if ctx.guild is None:
+        return
+    music_bot = music_manager.get_bot(ctx.guild.id)
+
+    if size is None:
+        outbox.say(ctx, f"⏩ Préchargement : {music_bot.prefetch_window} morceau(x) à l'avance")
+        return
+    if size < 0 or size > PREFETCH_MAX:
+        outbox.say(ctx, f"Le préchargement doit être entre 0 et {PREFETCH_MAX}")
+        return
+    music_bot.prefetch_window = size
+    if size == 0:
+        music_bot.cancel_prefetch()
+    elif music_bot.playing_item is not None:
+        music_bot.schedule_prefetch()
+    outbox.say(ctx, f"⏩ Préchargement réglé à {size} morceau(x)")
+
+@bot.command(name='gapless')
+async def gapless(ctx, mode: str = None):
+    """Activer/désactiver l'enchaînement sans blanc (on/off)"""
+    if ctx.guild is None:
+        return
+    music_bot = music_manager.get_bot(ctx.guild.id)
+
+    if mode is not None:
+        if mode.lower() not in ("on", "off"):
+            outbox.say(ctx, "Usage: `!gapless on|off`")
+            return
+        music_bot.gapless = mode.lower() == "on"
+    outbox.say(ctx, f"🔗 Enchaînement sans blanc : {'activé' if music_bot.gapless else 'désactivé'}")
 
 @bot.command(name='test_ffmpeg')
 async def test_ffmpeg(ctx):
     """Tester si FFmpeg marche"""
     try:
-        import subprocess
-        result = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True, timeout=5)
-        if result.returncode == 0:
-            await ctx.send("✅ FFmpeg trouvé et fonctionnel !")
+        # process asynchrone : un FFmpeg lent ne bloque pas l'event loop (et donc les autres guilds)
+        proc = await asyncio.create_subprocess_exec(
+            FFMPEG_PATH or 'ffmpeg', '-version',
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+        )
+        try:
+            returncode = await asyncio.wait_for(proc.wait(), 5)
+        except asyncio.TimeoutError:
+            proc.kill()
+            raise
+        if returncode == 0:
+            outbox.say(ctx, "✅ FFmpeg trouvé et fonctionnel !")
         else:
-            await ctx.send("❌ FFmpeg trouvé mais erreur")
+            outbox.say(ctx, "❌ FFmpeg trouvé mais erreur")
     except FileNotFoundError:
-        await ctx.send("❌ FFmpeg non trouvé dans le PATH")
+        outbox.say(ctx, "❌ FFmpeg non trouvé dans le PATH")
     except Exception as e:
-        await ctx.send(f"❌ Erreur FFmpeg : {e}")
+        outbox.say(ctx, f"❌ Erreur FFmpeg : {e}")
 
 @bot.command(name="playlist")
 async def playlist(ctx, url: str):
@@ -438,36 +3574,36 @@ async def playlist(ctx, url: str):
     # On réutilise la logique de play_url qui gère track OU playlist et alimente la queue
     await music_bot.play_url(ctx, url)
 
+QUEUE_PAGE_SIZE = 15
+
 @bot.command(name="queue", aliases=["q"])
-async def show_queue(ctx):
-    """Afficher la file d'attente"""
+async def show_queue(ctx, page: int = 1):
+    """Afficher la file d'attente (par pages)"""
     if ctx.guild is None:
         return
     music_bot = music_manager.get_bot(ctx.guild.id)
 
     if music_bot.current_song is None and music_bot.queue.empty():
-        await ctx.send("🧺 La file est vide.")
+        outbox.say(ctx, "🧺 La file est vide.")
         return
 
-    items = []
-    if not music_bot.queue.empty():
-        try:
-            size = music_bot.queue.qsize()
-            for _ in range(size):
-                item = music_bot.queue.get_nowait()
-                items.append(item)
-                music_bot.queue.put_nowait(item)  # remettre
-        except Exception:
-            pass
+    total = len(music_bot.queue)
+    pages = max(1, (total + QUEUE_PAGE_SIZE - 1) // QUEUE_PAGE_SIZE)
+    page = min(max(page, 1), pages)
+    start = (page - 1) * QUEUE_PAGE_SIZE
+    items = music_bot.queue.peek(start, QUEUE_PAGE_SIZE)
 
     lines = []
     if music_bot.current_song:
         lines.append(f"🎵 **En cours** : {music_bot.current_song}")
-    for i, it in enumerate(items[:15], start=1):
-        lines.append(f"{i}. {it['title']}")
+    for i, it in enumerate(items, start=start + 1):
+        duration = f" [{format_duration(it['duration'])}]" if it.get("duration") else ""
+        lines.append(f"{i}. {it['title']}{duration}")
+    if pages > 1:
+        lines.append(f"— page {page}/{pages} ({total} titres) —")
 
     msg = "\n".join(lines) if lines else "🧺 La file est vide."
-    await ctx.send(f"**Queue :**\n```\n{msg}\n```")
+    outbox.say(ctx, f"**Queue :**\n```\n{msg}\n```")
 
 @bot.command(name="skip", aliases=["s"])
 async def skip(ctx):
@@ -476,11 +3612,10 @@ async def skip(ctx):
         return
     music_bot = music_manager.get_bot(ctx.guild.id)
 
-    if music_bot.voice_client and music_bot.voice_client.is_playing():
-        music_bot.voice_client.stop()
-        await ctx.send("⏭️ Skip")
+    if music_bot.skip():
+        outbox.say(ctx, "⏭️ Skip")
     else:
-        await ctx.send("Rien à passer.")
+        outbox.say(ctx, "Rien à passer.")
 
 @bot.command(name="clear")
 async def clear_queue(ctx):
@@ -489,15 +3624,58 @@ async def clear_queue(ctx):
         return
     music_bot = music_manager.get_bot(ctx.guild.id)
 
-    cleared = 0
-    try:
-        while not music_bot.queue.empty():
-            music_bot.queue.get_nowait()
-            music_bot.queue.task_done()
-            cleared += 1
-    except Exception:
-        pass
-    await ctx.send(f"🧹 File vidée ({cleared} éléments).")
+    cleared = music_bot.clear()
+    outbox.say(ctx, f"🧹 File vidée ({cleared} éléments).")
+
+@bot.command(name="remove", aliases=["rm"])
+async def remove_track(ctx, position: int):
+    """Retirer un morceau de la file (position affichée par !queue)"""
+    if ctx.guild is None:
+        return
+    music_bot = music_manager.get_bot(ctx.guild.id)
+
+    if position < 1 or position > len(music_bot.queue):
+        outbox.say(ctx, f"Position invalide (1-{len(music_bot.queue)})")
+        return
+    item = music_bot.queue.remove(position - 1)
+    outbox.say(ctx, f"🗑️ Retiré : {item['title']}")
+
+@bot.command(name="move", aliases=["mv"])
+async def move_track(ctx, src: int, dst: int):
+    """Déplacer un morceau dans la file"""
+    if ctx.guild is None:
+        return
+    music_bot = music_manager.get_bot(ctx.guild.id)
+
+    size = len(music_bot.queue)
+    if not (1 <= src <= size and 1 <= dst <= size):
+        outbox.say(ctx, f"Positions invalides (1-{size})")
+        return
+    item = music_bot.queue.move(src - 1, dst - 1)
+    outbox.say(ctx, f"↕️ {item['title']} → position {dst}")
+
+@bot.command(name="jump", aliases=["skipto"])
+async def jump(ctx, position: int):
+    """Sauter directement à un morceau de la file"""
+    if ctx.guild is None:
+        return
+    music_bot = music_manager.get_bot(ctx.guild.id)
+
+    if position < 1 or position > len(music_bot.queue):
+        outbox.say(ctx, f"Position invalide (1-{len(music_bot.queue)})")
+        return
+    item = music_bot.jump(position - 1)
+    outbox.say(ctx, f"⏭️ Saut vers : {item['title']}")
+
+@bot.command(name="shuffle")
+async def shuffle(ctx):
+    """Mélanger la file"""
+    if ctx.guild is None:
+        return
+    music_bot = music_manager.get_bot(ctx.guild.id)
+
+    music_bot.queue.shuffle()
+    outbox.say(ctx, f"🔀 File mélangée ({len(music_bot.queue)} titres)")
 
 @bot.command(name='help_music')
 async def help_music(ctx):
@@ -518,19 +3696,30 @@ async def help_music(ctx):
 `!stop`                → Arrêter et vider la file
 `!leave` / `!disconnect` → Déconnecter le bot du vocal
 `!volume <0-100>`      → Régler le volume
+`!prefetch <0-10>`     → Nombre de morceaux suivants préparés à l'avance
+`!gapless on|off`      → Enchaînement sans blanc entre les morceaux
 
 **📋 File d’attente**
-`!queue` / `!q`        → Afficher la file en cours
+`!queue [page]` / `!q` → Afficher la file en cours
 `!clear`               → Vider la file
+`!remove <n>`          → Retirer le morceau n
+`!move <de> <vers>`    → Déplacer un morceau
+`!jump <n>`            → Sauter directement au morceau n
+`!shuffle`             → Mélanger la file
 `!current` / `!now`    → Afficher la chanson actuelle
 
 **📂 Fichiers locaux**
-`!list` / `!ls`        → Lister les fichiers audio disponibles
+`!list [page]` / `!ls` → Lister les fichiers audio disponibles
+`!rescan`              → Relire la bibliothèque (dossiers modifiés seulement)
+`!transcode`           → Pré-transcoder la bibliothèque en Opus
 
 **🔧 Outils & Debug**
 `!formats <url>`       → Voir les formats audio disponibles
 `!debug <url>`         → Infos debug sur un lien
 `!test_ffmpeg`         → Vérifier que FFmpeg est fonctionnel
+`!resolver`            → État du pool de résolution (file, en cours, timeouts)
+`!watchdog [n]`        → Derniers blocages de l'event loop
+`!ffmpeg`              → Process FFmpeg en cours (CPU, mémoire, refus)
 
 ---
 **Exemples :**
@@ -538,7 +3727,7 @@ async def help_music(ctx):
 `!play https://soundcloud.com/...`
 `!playlist https://soundcloud.com/user/sets/...`
     """
-    await ctx.send(help_text)
+    outbox.say(ctx, help_text)
 
 if __name__ == "__main__":
     # Lis le token depuis l'environnement (systemd: /etc/discord-music.env)